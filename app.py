@@ -1,65 +1,172 @@
 import dash
 import os
+import json
+import hashlib
 import logging
-from dash import html, dash_table, dcc, Input, Output, State, Dash
-import pandas as pd
-import plotly.express as px
-from flask import send_file
+from urllib.parse import urlencode
+from dash import html, dash_table, dcc, Input, Output, State
+from dash.exceptions import PreventUpdate
+from flask import Response, request, send_file, stream_with_context
 import dash_bootstrap_components as dbc
-from helpers import generate_fig_data, get_image_paths
+from dataset_manager import DatasetManager
+from helpers import drift_overview, fetch_df, generate_history_data, get_image_paths, get_thumbnail, index_columns, prune_thumbnails, request_filters, table_page, FigDataCache
+from records_store import stream_records_csv, stream_records_parquet, write_records_excel
 from log_config import configure_logging
 
 # Define values
-base_data_path = "/mcs_bead_project/data"
-records_path = '/mcs_bead_project/extracted/records.csv'
-record_columns = [
-    "date", "microscope", "objective", "test", "bead_size", "bead_number",
-    "far_red", "red", "uv", "dual", "x", "y", "z", "file_path"
-]
+# MCS_PROJECT_DIR points the app at another project directory (e.g. a
+# synthetic dataset from benchmarks/make_dataset.py)
+project_dir = os.path.normpath(os.environ.get("MCS_PROJECT_DIR", "/mcs_bead_project"))
+base_data_path = f"{project_dir}/data"
+extracted_path = f"{project_dir}/extracted"
+# Thumbnails live on the container's local disk, not on the shared volume
+thumbnail_dir = os.environ.get("MCS_THUMBNAIL_DIR", "/tmp/mcs_thumbnails")
+thumbnail_size = 400
+# Least recently used thumbnails are removed beyond this size
+thumbnail_cache_bytes = int(os.environ.get("MCS_THUMBNAIL_CACHE_MB", "500")) * 1024 * 1024
+image_max_age = 24 * 3600
+# Excel exports are built on request and cached on the container's local disk
+export_dir = os.environ.get("MCS_EXPORT_DIR", "/tmp/mcs_exports")
+export_cache_size = 32
+excel_max_rows = 1048575  # rows per Excel sheet, without the header
+# Rows per chunk of the streamed CSV/Parquet exports
+export_chunk_rows = 20000
+# Bead directories per page of the Image tab, rows per page of the tables
+bead_page_size = 10
+table_page_size = 25
 
 configure_logging()
 logger = logging.getLogger("app")
 
-# Load records defensively so the web app still starts (with empty filters)
-# even if extraction produced no/invalid data, rather than crashing on import.
-try:
-    df = pd.read_csv(records_path)
-    if df.empty:
-        logger.warning("records.csv has no data rows; starting app with empty filters.")
-except FileNotFoundError:
-    logger.error("records.csv not found at %s; starting app with empty dataset.", records_path)
-    df = pd.DataFrame(columns=record_columns)
-except Exception:
-    logger.exception("Failed to read %s; starting app with empty dataset.", records_path)
-    df = pd.DataFrame(columns=record_columns)
-
-df = df.assign(date=lambda x: pd.to_datetime(x['date'], format='%Y%m%d', errors='coerce'))
-
-microscope_list = df['microscope'].unique()
-objective_list = df['objective'].unique()
-test_list = df['test'].unique()
-bead_size_list = df['bead_size'].unique()
-bead_number_list = df['bead_number'].unique()
+# The extracted records (with their indexes, statistics cube, image index
+# and dropdown options) are reloaded in the background when process_data.py
+# publishes new ones, every MCS_RELOAD_INTERVAL seconds (0 disables it).
+# Every callback takes the current snapshot once and uses only that. Set
+# MCS_REVALIDATE_IMAGES=1 to re-list image directories whose mtime has
+# changed since extraction.
+dataset = DatasetManager(
+    extracted_path,
+    poll_interval=int(os.environ.get("MCS_RELOAD_INTERVAL", "10")),
+    revalidate_images=os.environ.get("MCS_REVALIDATE_IMAGES", "0") == "1"
+)
+dataset.start()
+# Thumbnails left from earlier runs count towards the cache size
+prune_thumbnails(thumbnail_dir, thumbnail_cache_bytes)
+# Cached figures belong to one dataset version and are dropped on reload
+fig_cache = FigDataCache()
 
 
-app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
+# The output tabs are created by update_output, so their callbacks refer to
+# components that are not in the initial layout.
+app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP], suppress_callback_exceptions=True)
 
 server = app.server
 
 # Flask route to serve images
+# Serves a downscaled thumbnail (cached on local disk) by default and the
+# full-size file with ?full=1. Both carry ETag/Last-Modified and a
+# Cache-Control max-age, so browsers revalidate instead of downloading the
+# same large image from the share again.
 @server.route('/images/<path:image_name>')
 def serve_image(image_name):
     # Construct the full path to the requested image
-    image_path = os.path.join(base_data_path, image_name)
+    image_path = os.path.normpath(os.path.join(base_data_path, image_name))
 
     # Check if the file exists and is under the base directory
     if os.path.isfile(image_path) and os.path.commonpath([base_data_path, image_path]) == base_data_path:
-        return send_file(image_path)
+        last_modified = os.path.getmtime(image_path)
+        if request.args.get('full') != '1':
+            thumb_path = get_thumbnail(image_path, thumbnail_dir, thumbnail_size, thumbnail_cache_bytes)
+            if thumb_path is not None:
+                return send_file(thumb_path, mimetype='image/jpeg', conditional=True, etag=True,
+                                 last_modified=last_modified, max_age=image_max_age)
+        return send_file(image_path, conditional=True, etag=True, last_modified=last_modified, max_age=image_max_age)
     else:
         return "", 200
 
+# Flask route to export records to Excel
+# The workbook is built only when someone asks for it, from the records
+# matching the filters in the query string (same names as the filter
+# options; none for all records), and cached per dataset version and
+# filters, so asking again is a plain file download.
+@server.route('/export/records.xlsx')
+def export_excel():
+    snapshot = dataset.current()
+    try:
+        filters = request_filters(request.args, snapshot.df)
+    except ValueError as e:
+        return f"Invalid filter: {e}", 400
+
+    key = hashlib.sha1(json.dumps([snapshot.version, filters], sort_keys=True).encode()).hexdigest()
+    export_file = f"{export_dir}/{key}.xlsx"
+    if not os.path.exists(export_file):
+        export_df = fetch_df(snapshot.df, index=snapshot.index, **filters)
+        if len(export_df) > excel_max_rows:
+            return f"{len(export_df)} records do not fit in an Excel sheet; narrow the filters or use records.csv.", 413
+        os.makedirs(export_dir, exist_ok=True)
+        write_records_excel(export_df, export_file)
+        logger.info("Built Excel export %s (%d rows) for %s", export_file, len(export_df), filters)
+
+        # Keep only the most recently built exports
+        exports = sorted(
+            (entry for entry in os.scandir(export_dir) if entry.name.endswith(".xlsx")),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        for entry in exports[:-export_cache_size]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    return send_file(export_file, as_attachment=True, download_name="records.xlsx", conditional=True, etag=True)
+
+# Flask routes to export records as CSV or Parquet
+# Same filters as the Excel export. The matching row positions come from the
+# records index, and the rows are converted and sent one chunk at a time
+# (one Parquet row group per chunk), so memory stays flat however many
+# records match and the download starts right away.
+def export_chunks(snapshot, filters):
+    positions = snapshot.index.positions(**filters)
+    for start in range(0, len(positions), export_chunk_rows):
+        yield snapshot.df.iloc[positions[start:start + export_chunk_rows]]
+
+
+@server.route('/export/records.csv')
+def export_csv():
+    snapshot = dataset.current()
+    try:
+        filters = request_filters(request.args, snapshot.df)
+    except ValueError as e:
+        return f"Invalid filter: {e}", 400
+    return Response(
+        stream_with_context(stream_records_csv(export_chunks(snapshot, filters), list(snapshot.df.columns))), mimetype='text/csv',
+        headers={'Content-Disposition': 'attachment; filename=records.csv'}
+    )
+
+
+@server.route('/export/records.parquet')
+def export_parquet():
+    snapshot = dataset.current()
+    try:
+        filters = request_filters(request.args, snapshot.df)
+    except ValueError as e:
+        return f"Invalid filter: {e}", 400
+    import pyarrow as pa
+
+    schema = pa.Schema.from_pandas(snapshot.df.head(1000), preserve_index=False)
+    return Response(
+        stream_with_context(stream_records_parquet(export_chunks(snapshot, filters), schema)),
+        mimetype='application/vnd.apache.parquet',
+        headers={'Content-Disposition': 'attachment; filename=records.parquet'}
+    )
+
+
 app.layout = html.Div([
     html.H2("Microscopy Bead Project", style={'textAlign': 'center'}),
+    # Dataset version the dropdown options were built from; checked on page
+    # load and then periodically by refresh_options
+    dcc.Store(id='dataset-version', data=dataset.current().version),
+    dcc.Interval(id='dataset-poll', interval=max(dataset.poll_interval, 5) * 1000, disabled=dataset.poll_interval <= 0),
     html.Div([
         dbc.Row(
             [
@@ -68,11 +175,11 @@ app.layout = html.Div([
                         dbc.Card(
                             [
                                 html.H5("Filters", style={"margin-top": 10}),
-                                html.Label('Microscope'), dcc.Dropdown( id='opt-microscope', options=[{'label': item, 'value': item} for item in microscope_list]),
-                                html.Label('Objective'), dcc.Dropdown( id='opt-objective', options=[{'label': item, 'value': item} for item in objective_list]),
-                                html.Label('Test'), dcc.Dropdown( id='opt-test', options=[{'label': item, 'value': item} for item in test_list]),
-                                html.Label('Bead Size'), dcc.Dropdown( id='opt-bead-size', options=[{'label': item, 'value': item} for item in bead_size_list]),
-                                html.Label('Bead Number'), dcc.Dropdown( id='opt-bead-number', options=[{'label': item, 'value': item} for item in bead_number_list]),
+                                html.Label('Microscope'), dcc.Dropdown( id='opt-microscope', options=dataset.current().options['microscope']),
+                                html.Label('Objective'), dcc.Dropdown( id='opt-objective', options=dataset.current().options['objective']),
+                                html.Label('Test'), dcc.Dropdown( id='opt-test', options=dataset.current().options['test']),
+                                html.Label('Bead Size'), dcc.Dropdown( id='opt-bead-size', options=dataset.current().options['bead_size']),
+                                html.Label('Bead Number'), dcc.Dropdown( id='opt-bead-number', options=dataset.current().options['bead_number']),
                                 # html.Label('Start Date'), dcc.DatePickerSingle(id='date-picker', placeholder='Select a date', style={'margin-bottom': '20px'}),
                                 html.Label('Date Range'), html.Br(), dcc.DatePickerRange(id='opt-date', display_format='YYYY-MM-DD'),
                                 html.Label('Consider Previous Values for Line Deviation'), html.Br(), dcc.Input(id='opt-consider-limit', type='number', value=3, min=1, max=50),
@@ -119,6 +226,24 @@ app.layout = html.Div([
 
 
 
+@app.callback(
+    Output("opt-microscope", "options"),
+    Output("opt-objective", "options"),
+    Output("opt-test", "options"),
+    Output("opt-bead-size", "options"),
+    Output("opt-bead-number", "options"),
+    Output("dataset-version", "data"),
+    Input("dataset-poll", "n_intervals"),
+    State("dataset-version", "data")
+)
+def refresh_options(n_intervals, version):
+    # Only send new options when the dataset was reloaded since
+    snapshot = dataset.current()
+    if snapshot.version == version:
+        raise PreventUpdate
+    return [snapshot.options[col] for col in index_columns] + [snapshot.version]
+
+
 @app.callback(
     Output("tab-output", "children"),
     Input("submit-button-state", "n_clicks"),
@@ -143,9 +268,13 @@ def update_output(n_clicks, microscope, objective, test, bead_size, bead_number,
         start_date, end_date, consider_limit, warning_percentage
     )
 
-    fig, considerd_df, change_df, fig_name, warning = generate_fig_data(df, microscope, objective, test, bead_size, bead_number, start_date, end_date, consider_limit, warning_percentage)
+    snapshot = dataset.current()
+    fig, change_df, fig_name, warning = fig_cache.generate_fig_data(
+        snapshot.version, snapshot.df, microscope, objective, test, bead_size, bead_number, start_date, end_date,
+        consider_limit, warning_percentage, index=snapshot.index, stats=snapshot.stats, stats_index=snapshot.stats_index
+    )
 
-    if fig is None or considerd_df is None or change_df is None:
+    if fig is None or change_df is None:
         logger.warning("No data/figure produced for the requested filters.")
         return html.Div("No data found with the inputs!", style={"margin-top": "15px", "margin-left": "15px"})
 
@@ -154,36 +283,51 @@ def update_output(n_clicks, microscope, objective, test, bead_size, bead_number,
         figure=fig
     )
 
+    # The tables and the Image tab are filled by their own callbacks from the
+    # query kept in this store, one page at a time, so this response stays
+    # small whatever the date range.
+    query_store = dcc.Store(id='output-query', data={
+        'filters': {
+            'microscope': microscope, 'objective': objective, 'test': test,
+            'bead_size': bead_size, 'bead_number': bead_number,
+            'start_date': start_date, 'end_date': end_date
+        },
+        'consider_limit': consider_limit,
+        'warning_percentage': warning_percentage
+    })
+
+    considerd_df = fetch_df(snapshot.df, microscope, objective, test, bead_size, bead_number, start_date, end_date, snapshot.index)
+
+    # Image sections (one per unique bead directory) are rendered by
+    # update_bead_page once the tab is opened.
+    bead_dir_count = considerd_df['file_path'].map(os.path.dirname).nunique()
     bead_tab = html.Div(
         [
-            # Loop through bead paths to generate sections
-            html.Div(
-                [
-                    html.H6(os.path.dirname(bead_path), style={'textAlign': 'center'}),  # Bead path header
-
-                    # Display images for this bead path
-                    html.Div(
-                        [
-                            html.Img(
-                                src=f"/images/{image}",  # Replace with actual image path logic
-                                title=os.path.basename(image),
-                                style={"max-width": "400px", "max-height": "400px", "margin": "10px", "object-fit": "contain"}
-                            )
-                            for image in get_image_paths(bead_path)
-                        ],
-                        style={"display": "flex", "flexWrap": "wrap", "justifyContent": "center"}
-                    )
-                ],
-                style={"margin-bottom": "30px"}  # Add spacing between bead sections
-            )
-            for bead_path in considerd_df['file_path']
+            dbc.Pagination(
+                id='bead-page',
+                max_value=max(1, -(-bead_dir_count // bead_page_size)),
+                active_page=1,
+                fully_expanded=False,
+                first_last=True,
+                previous_next=True,
+                style={"justifyContent": "center", "margin-top": "10px"}
+            ),
+            html.Div(id='bead-sections')
         ]
     )
 
     considered_tab = dash_table.DataTable(
         id='considered-table',
         columns=[{"name": i, "id": i} for i in considerd_df.columns],
-        data=considerd_df.to_dict('records'),
+        page_current=0,
+        page_size=table_page_size,
+        page_count=max(1, -(-len(considerd_df) // table_page_size)),
+        page_action='custom',
+        sort_action='custom',
+        sort_mode='multi',
+        sort_by=[],
+        filter_action='custom',
+        filter_query='',
         style_table={'overflowX': 'auto'},
         style_header={
             'backgroundColor': 'rgb(230, 230, 230)',
@@ -193,9 +337,16 @@ def update_output(n_clicks, microscope, objective, test, bead_size, bead_number,
     )
 
     change_tab = dash_table.DataTable(
-        id='considered-table',
+        id='change-table',
         columns=[{"name": i, "id": i} for i in change_df.columns],
-        data=change_df.to_dict('records'),
+        page_current=0,
+        page_size=table_page_size,
+        page_action='custom',
+        sort_action='custom',
+        sort_mode='multi',
+        sort_by=[],
+        filter_action='custom',
+        filter_query='',
         style_table={'overflowX': 'auto'},
         style_header={
             'backgroundColor': 'rgb(230, 230, 230)',
@@ -204,6 +355,36 @@ def update_output(n_clicks, microscope, objective, test, bead_size, bead_number,
         style_cell={'textAlign': 'left'}
     )
 
+    # Deviation of every date against its previous dates, filled by
+    # update_history / update_history_table once the tab is opened
+    history_tab = html.Div(
+        [
+            html.Div(id='history-figure'),
+            dash_table.DataTable(
+                id='history-table',
+                columns=[{"name": i, "id": i} for i in ['date', 'metric', 'mean', 'baseline', 'change (%)', 'warning']],
+                page_current=0,
+                page_size=table_page_size,
+                page_action='custom',
+                sort_action='custom',
+                sort_mode='multi',
+                sort_by=[],
+                filter_action='custom',
+                filter_query='',
+                style_table={'overflowX': 'auto'},
+                style_header={
+                    'backgroundColor': 'rgb(230, 230, 230)',
+                    'fontWeight': 'bold'
+                },
+                style_cell={'textAlign': 'left'},
+                style_data_conditional=[{
+                    'if': {'filter_query': '{warning} = "True"'},
+                    'backgroundColor': 'rgb(255, 228, 228)'
+                }]
+            )
+        ]
+    )
+
     output=dcc.Tabs( 
         [ 
             dcc.Tab(
@@ -213,7 +394,7 @@ def update_output(n_clicks, microscope, objective, test, bead_size, bead_number,
                     children=[ figure_tab ],
                     style={"margin-top":"50%","height": "100%"} 
                 ), 
-                label="Figure", id="tab-figure",
+                label="Figure", id="tab-figure", value="tab-figure",
                 style={"margin-top":"0%"}
             ),
             dcc.Tab(
@@ -223,7 +404,7 @@ def update_output(n_clicks, microscope, objective, test, bead_size, bead_number,
                     children=[ considered_tab ],
                     style={"margin-top":"50%","height": "100%"} 
                 ), 
-                label="Data", id="tab-considered",
+                label="Data", id="tab-considered", value="tab-considered",
                 style={"margin-top":"0%"}
             ),
             dcc.Tab(
@@ -233,7 +414,27 @@ def update_output(n_clicks, microscope, objective, test, bead_size, bead_number,
                     children=[ change_tab ],
                     style={"margin-top":"50%","height": "100%"} 
                 ), 
-                label="Deviation", id="tab-change",
+                label="Deviation", id="tab-change", value="tab-change",
+                style={"margin-top":"0%"}
+            ),
+            dcc.Tab(
+                dcc.Loading(
+                    id="loading-output-6",
+                    type="default",
+                    children=[ history_tab ],
+                    style={"margin-top":"50%","height": "100%"} 
+                ), 
+                label="History", id="tab-history", value="tab-history",
+                style={"margin-top":"0%"}
+            ),
+            dcc.Tab(
+                dcc.Loading(
+                    id="loading-output-5",
+                    type="default",
+                    children=[ html.Div(id='overview-content') ],
+                    style={"margin-top":"50%","height": "100%"} 
+                ), 
+                label="Overview", id="tab-overview", value="tab-overview",
                 style={"margin-top":"0%"}
             ),
             dcc.Tab(
@@ -243,15 +444,220 @@ def update_output(n_clicks, microscope, objective, test, bead_size, bead_number,
                     children=[ bead_tab ],
                     style={"margin-top":"50%","height": "100%"} 
                 ), 
-                label="Image", id="tab-bead",
+                label="Image", id="tab-bead", value="tab-bead",
                 style={"margin-top":"0%"}
             )
-        ]
+        ],
+        id="output-tabs",
+        value="tab-figure"
+    )
+    export_query = urlencode({k: v for k, v in query_store.data['filters'].items() if v is not None})
+    export_links = html.Div(
+        [
+            "Download records: ",
+            html.A("Excel", href=f"/export/records.xlsx?{export_query}"), " | ",
+            html.A("CSV", href=f"/export/records.csv?{export_query}"), " | ",
+            html.A("Parquet", href=f"/export/records.parquet?{export_query}")
+        ],
+        style={"margin-left": "15px", "float": "right"}
     )
+    output = html.Div([query_store, export_links, output])
 
     return output
 
 
+@app.callback(
+    Output("bead-sections", "children"),
+    Input("output-tabs", "value"),
+    Input("bead-page", "active_page"),
+    State("output-query", "data")
+)
+def update_bead_page(tab, page, query):
+    # Nothing is listed until the Image tab is actually opened
+    if tab != "tab-bead" or not query:
+        raise PreventUpdate
+
+    snapshot = dataset.current()
+    considerd_df = fetch_df(snapshot.df, index=snapshot.index, **query['filters'])
+    bead_paths = considerd_df['file_path']
+    # One section per bead directory (the first data file stands for it)
+    bead_paths = bead_paths[~bead_paths.map(os.path.dirname).duplicated()]
+    page = page or 1
+    page_paths = bead_paths.iloc[(page - 1) * bead_page_size:page * bead_page_size]
+
+    return [
+        html.Div(
+            [
+                html.H6(os.path.dirname(bead_path), style={'textAlign': 'center'}),  # Bead path header
+
+                # Display images for this bead path
+                html.Div(
+                    [
+                        html.A(
+                            html.Img(
+                                src=f"/images/{image}",  # thumbnail; the link opens the full-size image
+                                title=os.path.basename(image),
+                                style={"max-width": "400px", "max-height": "400px", "margin": "10px", "object-fit": "contain"}
+                            ),
+                            href=f"/images/{image}?full=1",
+                            target="_blank"
+                        )
+                        for image in get_image_paths(bead_path, base_path=f"{base_data_path}/", image_index=snapshot.image_index)
+                    ],
+                    style={"display": "flex", "flexWrap": "wrap", "justifyContent": "center"}
+                )
+            ],
+            style={"margin-bottom": "30px"}  # Add spacing between bead sections
+        )
+        for bead_path in page_paths
+    ]
+
+
+def query_history(query):
+    """Deviation history figure and rows for the submitted query"""
+    filters = query['filters']
+    snapshot = dataset.current()
+    return generate_history_data(
+        snapshot.df, filters['microscope'], filters['objective'], filters['test'],
+        filters['bead_size'], filters['bead_number'], filters['start_date'], filters['end_date'],
+        query['consider_limit'], query['warning_percentage'], index=snapshot.index, stats=snapshot.stats,
+        stats_index=snapshot.stats_index
+    )
+
+
+@app.callback(
+    Output("history-figure", "children"),
+    Input("output-tabs", "value"),
+    State("output-query", "data")
+)
+def update_history(tab, query):
+    if tab != "tab-history" or not query:
+        raise PreventUpdate
+    fig, _ = query_history(query)
+    if fig is None:
+        return html.Div("No data found with the inputs!", style={"margin-top": "15px", "margin-left": "15px"})
+    return dcc.Graph(id='history-plotly-figure', figure=fig)
+
+
+@app.callback(
+    Output("history-table", "data"),
+    Output("history-table", "page_count"),
+    Input("output-tabs", "value"),
+    Input("history-table", "page_current"),
+    Input("history-table", "page_size"),
+    Input("history-table", "sort_by"),
+    Input("history-table", "filter_query"),
+    State("output-query", "data")
+)
+def update_history_table(tab, page_current, page_size, sort_by, filter_query, query):
+    if tab != "tab-history" or not query:
+        raise PreventUpdate
+    _, history = query_history(query)
+    if history is None:
+        return [], 1
+    history = history.assign(
+        date=lambda x: x['date'].dt.strftime('%Y-%m-%d'), warning=lambda x: x['warning'].astype(str)
+    ).round(4)
+    return table_page(history, page_current, page_size, sort_by, filter_query)
+
+
+@app.callback(
+    Output("overview-content", "children"),
+    Input("output-tabs", "value"),
+    State("output-query", "data")
+)
+def update_overview(tab, query):
+    # Drift of every (microscope, objective, test, bead_size, bead_number)
+    # group matching the filters (empty filters: the whole fleet), computed
+    # once the tab is opened
+    if tab != "tab-overview" or not query:
+        raise PreventUpdate
+
+    snapshot = dataset.current()
+    if snapshot.stats is not None:
+        source = fetch_df(snapshot.stats, index=snapshot.stats_index, **query['filters'])
+    else:
+        source = fetch_df(snapshot.df, index=snapshot.index, **query['filters'])
+    overview_df = drift_overview(
+        source, consider_limit=query['consider_limit'],
+        warning_percentage=query['warning_percentage'], from_stats=snapshot.stats is not None
+    )
+    warnings = int(overview_df['warning'].sum())
+    overview_df = overview_df.drop(columns=['warning']).assign(
+        last_date=lambda x: x['last_date'].dt.strftime('%Y-%m-%d')
+    ).round(2)
+
+    return [
+        html.H6(
+            f"{warnings} of {len(overview_df)} groups deviate more than {query['warning_percentage']}% "
+            f"from the mean of their previous {query['consider_limit']} dates",
+            style={'textAlign': 'center', 'margin-top': '10px'}
+        ),
+        dash_table.DataTable(
+            id='overview-table',
+            columns=[{"name": i, "id": i} for i in overview_df.columns],
+            data=overview_df.to_dict('records'),
+            page_size=table_page_size,
+            sort_action='native',
+            filter_action='native',
+            style_table={'overflowX': 'auto'},
+            style_header={
+                'backgroundColor': 'rgb(230, 230, 230)',
+                'fontWeight': 'bold'
+            },
+            style_cell={'textAlign': 'left'},
+            style_data_conditional=[{
+                'if': {'filter_query': '{status} = "🔴"'},
+                'backgroundColor': 'rgb(255, 228, 228)'
+            }]
+        )
+    ]
+
+
+# Data and Deviation tables: paging, sorting and filtering happen here, on
+# the server, and only the visible page is sent to the browser.
+@app.callback(
+    Output("considered-table", "data"),
+    Output("considered-table", "page_count"),
+    Input("considered-table", "page_current"),
+    Input("considered-table", "page_size"),
+    Input("considered-table", "sort_by"),
+    Input("considered-table", "filter_query"),
+    State("output-query", "data")
+)
+def update_considered_table(page_current, page_size, sort_by, filter_query, query):
+    if not query:
+        raise PreventUpdate
+    snapshot = dataset.current()
+    considerd_df = fetch_df(snapshot.df, index=snapshot.index, **query['filters'])
+    return table_page(considerd_df, page_current, page_size, sort_by, filter_query)
+
+
+@app.callback(
+    Output("change-table", "data"),
+    Output("change-table", "page_count"),
+    Input("change-table", "page_current"),
+    Input("change-table", "page_size"),
+    Input("change-table", "sort_by"),
+    Input("change-table", "filter_query"),
+    State("output-query", "data")
+)
+def update_change_table(page_current, page_size, sort_by, filter_query, query):
+    if not query:
+        raise PreventUpdate
+    filters = query['filters']
+    snapshot = dataset.current()
+    _, change_df, _, _ = fig_cache.generate_fig_data(
+        snapshot.version, snapshot.df, filters['microscope'], filters['objective'], filters['test'],
+        filters['bead_size'], filters['bead_number'], filters['start_date'], filters['end_date'],
+        query['consider_limit'], query['warning_percentage'], index=snapshot.index, stats=snapshot.stats,
+        stats_index=snapshot.stats_index
+    )
+    if change_df is None:
+        return [], 1
+    return table_page(change_df, page_current, page_size, sort_by, filter_query)
+
+
 if __name__ == '__main__':
     logger.info("Starting Dash app on http://0.0.0.0:8050")
     app.run_server(debug=True, host='0.0.0.0', port=8050)
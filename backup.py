@@ -0,0 +1,230 @@
+import os
+import gzip
+import json
+import shutil
+import hashlib
+import logging
+import argparse
+from datetime import datetime
+
+from log_config import configure_logging
+from records_store import (
+    dataset_version, load_records, read_changelog, rebase_changelog, reset_changelog
+)
+
+# Backups of the extracted records, kept in <root>/backup.
+#
+# Every backed-up file is stored once as a gzip-compressed blob named after
+# the SHA-256 of its content (backup/blobs/<hash>.gz), so identical files
+# (e.g. an unchanged dataless.txt) are shared between backups. A small index
+# (backup/index.json) lists the backups, oldest first, each with its
+# timestamp, the hash of records.csv, the row count of the records (records.csv
+# with records.log applied) and the blobs of all its files. The index also
+# records the size/mtime stamp of the records.csv and records.log the latest
+# backup was taken from: if they still have that stamp, nothing is read or
+# hashed to decide that no new backup is needed.
+#
+# Pruning drops the oldest index entries beyond the limit and then deletes the
+# blobs no remaining backup refers to. Timestamped backup folders written by
+# earlier versions are left untouched (remove them by hand once no longer
+# needed).
+#
+# Use: python3 backup.py -d </path/to/dir> list
+#      python3 backup.py -d </path/to/dir> restore [<timestamp>|<hash prefix>|latest]
+
+BACKUP_INDEX_VERSION = 1
+backup_files = ["records.csv", "records.log", "unprocessed.txt", "dataless.txt"]
+
+logger = logging.getLogger("backup")
+
+
+def backup_paths(backup_dir):
+    """Paths of the backup index and the blob directory"""
+    return f"{backup_dir}/index.json", f"{backup_dir}/blobs"
+
+
+def load_backup_index(backup_dir):
+    """Backups listed in the index, oldest first ([] if there is no index yet)"""
+    index_file, _ = backup_paths(backup_dir)
+    try:
+        with open(index_file) as fh:
+            index = json.load(fh)
+    except FileNotFoundError:
+        return []
+    if index.get("version") != BACKUP_INDEX_VERSION:
+        raise ValueError(f"{index_file} has unsupported version {index.get('version')}")
+    return index["backups"]
+
+
+def write_backup_index(backup_dir, backups):
+    """Write the backup index (via temp file + rename)"""
+    index_file, _ = backup_paths(backup_dir)
+    tmp_file = f"{index_file}.tmp"
+    with open(tmp_file, "w") as fh:
+        json.dump({"version": BACKUP_INDEX_VERSION, "backups": backups}, fh, indent=1)
+    os.replace(tmp_file, index_file)
+
+
+def store_blob(blob_dir, path):
+    """Compress a file into the blob store; returns (content hash, line count).
+
+    The file is read once: hashing, line counting and compression happen on
+    the same chunks. A blob that already exists is kept as is.
+    """
+    os.makedirs(blob_dir, exist_ok=True)
+    tmp_file = f"{blob_dir}/.{os.getpid()}.tmp"
+    h = hashlib.sha256()
+    lines = 0
+    with open(path, "rb") as src, gzip.open(tmp_file, "wb") as dst:
+        for chunk in iter(lambda: src.read(1 << 20), b""):
+            h.update(chunk)
+            lines += chunk.count(b"\n")
+            dst.write(chunk)
+    digest = h.hexdigest()
+    blob_file = f"{blob_dir}/{digest}.gz"
+    if os.path.exists(blob_file):
+        os.remove(tmp_file)
+    else:
+        os.replace(tmp_file, blob_file)
+    return digest, lines
+
+
+def backup_records(backup_dir, fetch_dir):
+    """Back up the records in fetch_dir unless they match the latest backup.
+
+    Returns the new index entry, or None if nothing was backed up.
+    """
+    version = dataset_version(fetch_dir)
+    if version is None:
+        logger.info("No existing records.csv to back up; skipping backup.")
+        return None
+
+    backups = load_backup_index(backup_dir)
+    latest = backups[-1] if backups else None
+    if latest is not None and latest.get("source_version") == version:
+        logger.info("Records unchanged since last backup; skipping backup.")
+        return None
+
+    _, blob_dir = backup_paths(backup_dir)
+    files = {}
+    rows = None
+    changes = read_changelog(fetch_dir)
+    for name in backup_files:
+        path = f"{fetch_dir}/{name}"
+        if not os.path.exists(path) or (name == "records.log" and not changes):
+            # A changelog written for another records.csv does not belong to these records
+            continue
+        digest, lines = store_blob(blob_dir, path)
+        files[name] = digest
+        if name == "records.csv":
+            rows = max(0, lines - 1)  # without the header
+    if changes:
+        # The records as readers see them: records.csv with its changelog applied
+        rows = len(load_records(fetch_dir, columns=["file_path"]))
+
+    if (latest is not None and latest["hash"] == files["records.csv"]
+            and latest["files"].get("records.log") == files.get("records.log")):
+        # Same content, only rewritten: remember the new stamp so the file is
+        # not hashed again next time
+        latest["source_version"] = version
+        write_backup_index(backup_dir, backups)
+        logger.info("Records unchanged since last backup; skipping backup.")
+        return None
+
+    entry = {
+        "timestamp": datetime.now().strftime("%Y%m%d_%H%M%S"),
+        "hash": files["records.csv"],
+        "rows": rows,
+        "source_version": version,
+        "files": files,
+    }
+    backups.append(entry)
+    write_backup_index(backup_dir, backups)
+    logger.info("Backed up the records (%d rows) as %s", rows, entry["hash"][:12])
+    return entry
+
+
+def prune_backups(backup_dir, backup_limit):
+    """Keep the newest backup_limit backups and delete blobs no backup refers to"""
+    backups = load_backup_index(backup_dir)
+    if len(backups) > backup_limit:
+        removed = len(backups) - backup_limit
+        backups = backups[removed:]
+        write_backup_index(backup_dir, backups)
+        logger.info("Pruned %d old backups.", removed)
+
+    _, blob_dir = backup_paths(backup_dir)
+    used = {f"{digest}.gz" for entry in backups for digest in entry["files"].values()}
+    try:
+        blob_names = os.listdir(blob_dir)
+    except FileNotFoundError:
+        return
+    for name in blob_names:
+        if name.endswith(".gz") and name not in used:
+            try:
+                os.remove(f"{blob_dir}/{name}")
+            except Exception as e:
+                logger.warning("Could not remove old backup blob %s: %s", name, e)
+
+
+def find_backup(backups, ref):
+    """Backup matching ref: 'latest', a timestamp or a records.csv hash prefix"""
+    if not backups:
+        raise LookupError("There are no backups.")
+    if ref == "latest":
+        return backups[-1]
+    matches = [entry for entry in backups if entry["timestamp"] == ref or entry["hash"].startswith(ref)]
+    if len(matches) != 1:
+        raise LookupError(f"{len(matches)} backups match {ref!r}.")
+    return matches[0]
+
+
+def restore_backup(backup_dir, fetch_dir, ref="latest"):
+    """Restore the files of a backup into fetch_dir; the current records are backed up first"""
+    entry = find_backup(load_backup_index(backup_dir), ref)
+    backup_records(backup_dir, fetch_dir)
+    _, blob_dir = backup_paths(backup_dir)
+    # records.csv first: the changelog is rebased onto the restored file below
+    names = sorted(entry["files"], key=lambda name: name != "records.csv")
+    for name in names:
+        target = f"{fetch_dir}/{name}"
+        tmp_file = f"{target}.tmp"
+        with gzip.open(f"{blob_dir}/{entry['files'][name]}.gz", "rb") as src, open(tmp_file, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        os.replace(tmp_file, target)
+    # Restoring gives records.csv a new mtime, so the restored changelog would
+    # no longer match it; a backup without a changelog drops the current one
+    if "records.log" in entry["files"]:
+        rebase_changelog(fetch_dir)
+    else:
+        reset_changelog(fetch_dir)
+    logger.info("Restored backup %s (%s rows) into %s", entry["timestamp"], entry["rows"], fetch_dir)
+    return entry
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List or restore backups of the extracted records.")
+    parser.add_argument('-d', '--directory', type=str, default="/mcs_bead_project", help="Path to the directory (optional).")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="List the backups, oldest first.")
+    restore_parser = subparsers.add_parser("restore", help="Restore a backup into the extracted directory.")
+    restore_parser.add_argument("backup", nargs="?", default="latest",
+                                help="Timestamp or records.csv hash prefix of the backup (default: latest).")
+    args = parser.parse_args()
+
+    backup_dir = f"{args.directory}/backup"
+    fetch_dir = f"{args.directory}/extracted"
+    configure_logging()
+
+    if args.command == "list":
+        for entry in load_backup_index(backup_dir):
+            print(f"{entry['timestamp']}  {entry['hash'][:12]}  {entry['rows']} rows")
+    else:
+        try:
+            restore_backup(backup_dir, fetch_dir, args.backup)
+        except LookupError as e:
+            parser.exit(1, f"{e}\n")
+
+
+if __name__ == '__main__':
+    main()
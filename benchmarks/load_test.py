@@ -0,0 +1,304 @@
+import sys
+import json
+import time
+import random
+import itertools
+import threading
+import argparse
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta
+
+# Load test for a running app: many users submitting filters at once.
+#
+# Virtual users (threads) send a weighted mix of requests:
+#   page       GET /_dash-layout, what every browser loads first
+#   microscope / objective / test / dated
+#              the update_output callback (POST /_dash-update-component),
+#              exactly as the Submit button sends it, filtering on the
+#              microscope, + objective, + test, or + test and a 90-day range
+#   images     GET /images/<path>, a bead thumbnail as the Image tab loads it
+# Filter values come from the dropdown options in the app's layout, the
+# date range of the records from its CSV export and image paths from the
+# update_bead_page callback for a few queries before the run.
+# Every request opens a new connection (urllib), as several browsers would.
+# Reports throughput and p50/p95/p99 latency and response sizes per kind.
+#
+# Use: MCS_PROJECT_DIR=/tmp/mcs_synthetic python3 app.py
+#      python3 benchmarks/load_test.py --url http://127.0.0.1:8050 -c 20 --duration 60
+
+default_mix = "page=1,microscope=1,objective=2,test=4,dated=2,images=6"
+filter_profiles = {
+    "microscope": ("microscope",),
+    "objective": ("microscope", "objective"),
+    "test": ("microscope", "objective", "test"),
+    "dated": ("microscope", "objective", "test"),
+}
+filter_components = {
+    "microscope": "opt-microscope",
+    "objective": "opt-objective",
+    "test": "opt-test",
+    "bead_size": "opt-bead-size",
+    "bead_number": "opt-bead-number",
+}
+date_window = timedelta(days=90)
+
+
+def parse_mix(text):
+    """{kind: weight} from 'kind=weight,...'"""
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in filter_profiles and kind not in ("page", "images"):
+            raise ValueError(f"unknown request kind {kind!r}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def http_request(url, payload=None, timeout=60):
+    """(status, response bytes) of a GET, or a JSON POST when payload is given"""
+    data = None
+    headers = {}
+    if payload is not None:
+        data = json.dumps(payload).encode()
+        headers["Content-Type"] = "application/json"
+    req = urllib.request.Request(url, data=data, headers=headers)
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def layout_options(base_url):
+    """Dropdown values of every filter in the app's layout: {column: [values]}"""
+    status, body = http_request(f"{base_url}/_dash-layout")
+    if status != 200:
+        raise RuntimeError(f"/_dash-layout returned {status}")
+    ids = {component: col for col, component in filter_components.items()}
+    options = {}
+
+    def walk(node):
+        if isinstance(node, dict):
+            props = node.get("props", {})
+            if props.get("id") in ids:
+                options[ids[props["id"]]] = [option["value"] for option in props.get("options") or []]
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    walk(json.loads(body))
+    return options
+
+
+def record_dates(base_url):
+    """First and last record date, from the CSV export of all records"""
+    with urllib.request.urlopen(f"{base_url}/export/records.csv", timeout=300) as response:
+        next(response)  # header
+        dates = {line.split(b",", 1)[0] for line in response}
+    dates = [datetime.strptime(value.decode().replace("-", "")[:8], "%Y%m%d").date() for value in dates if value]
+    return min(dates), max(dates)
+
+
+def output_payload(filters):
+    """update_output request body for the Submit button with the given filters"""
+    state = [
+        {"id": component, "property": "value", "value": filters.get(col)}
+        for col, component in filter_components.items()
+    ]
+    state += [
+        {"id": "opt-date", "property": "start_date", "value": filters.get("start_date")},
+        {"id": "opt-date", "property": "end_date", "value": filters.get("end_date")},
+        {"id": "opt-consider-limit", "property": "value", "value": 3},
+        {"id": "opt-warning-percentage", "property": "value", "value": 15},
+    ]
+    return {
+        "output": "tab-output.children",
+        "outputs": {"id": "tab-output", "property": "children"},
+        "inputs": [{"id": "submit-button-state", "property": "n_clicks", "value": 1}],
+        "changedPropIds": ["submit-button-state.n_clicks"],
+        "state": state,
+    }
+
+
+def bead_page_payload(filters):
+    """update_bead_page request body for opening the Image tab of a query"""
+    query = {
+        "filters": {col: filters.get(col) for col in list(filter_components) + ["start_date", "end_date"]},
+        "consider_limit": 3,
+        "warning_percentage": 15,
+    }
+    return {
+        "output": "bead-sections.children",
+        "outputs": {"id": "bead-sections", "property": "children"},
+        "inputs": [
+            {"id": "output-tabs", "property": "value", "value": "tab-bead"},
+            {"id": "bead-page", "property": "active_page", "value": 1},
+        ],
+        "changedPropIds": ["output-tabs.value"],
+        "state": [{"id": "output-query", "property": "data", "value": query}],
+    }
+
+
+def random_filters(rng, profile, options, dates):
+    """Filters of one request of the given profile (dates: first and last record date)"""
+    filters = {col: rng.choice(options[col]) for col in filter_profiles[profile] if options.get(col)}
+    if profile == "dated":
+        first, last = dates
+        days = max(0, (last - first - date_window).days)
+        start = first + timedelta(days=rng.randint(0, days))
+        filters["start_date"] = start.isoformat()
+        filters["end_date"] = (start + date_window).isoformat()
+    return filters
+
+
+def collect_images(base_url, options, rng, queries):
+    """Thumbnail URLs listed on the first Image tab page of a few random microscopes"""
+    images = set()
+
+    def walk(node):
+        if isinstance(node, dict):
+            src = node.get("src")
+            if isinstance(src, str) and src.startswith("/images/"):
+                images.add(src)
+            node = list(node.values())
+        if isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    for _ in range(queries):
+        filters = random_filters(rng, "microscope", options, None)
+        status, body = http_request(f"{base_url}/_dash-update-component", bead_page_payload(filters))
+        if status == 200:
+            walk(json.loads(body))
+    return sorted(images)
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return None
+    rank = max(1, -(-len(values) * percent // 100))
+    return values[int(rank) - 1]
+
+
+def summarize(samples, elapsed):
+    """Per-kind and overall statistics of (kind, ok, seconds, bytes) samples"""
+    kinds = sorted({kind for kind, _, _, _ in samples})
+    summary = {}
+    for kind in kinds + ["all"]:
+        selected = [s for s in samples if kind == "all" or s[0] == kind]
+        latencies = sorted(seconds * 1000 for _, _, seconds, _ in selected)
+        sizes = [size for _, _, _, size in selected]
+        summary[kind] = {
+            "requests": len(selected),
+            "errors": sum(1 for _, ok, _, _ in selected if not ok),
+            "throughput": len(selected) / elapsed if elapsed else None,
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "mean_bytes": sum(sizes) / len(sizes) if sizes else None,
+            "max_bytes": max(sizes) if sizes else None,
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a running app with concurrent users.")
+    parser.add_argument('--url', type=str, default="http://127.0.0.1:8050", help="Base URL of the app (optional).")
+    parser.add_argument('-c', '--concurrency', type=int, default=10, help="Concurrent users (optional, default: 10).")
+    parser.add_argument('--duration', type=float, default=30, help="Seconds to run (optional, default: 30).")
+    parser.add_argument('-n', '--requests', type=int, default=None,
+                        help="Stop after this many requests instead (optional).")
+    parser.add_argument('--mix', type=str, default=default_mix,
+                        help=f"Request kinds and their weights (optional, default: {default_mix}).")
+    parser.add_argument('--image-queries', type=int, default=20,
+                        help="Queries whose Image tab is listed to find thumbnails (optional, default: 20).")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed (optional, default: 0).")
+    parser.add_argument('-o', '--output', type=str, default=None, help="Write the results as JSON (optional).")
+    args = parser.parse_args()
+
+    base_url = args.url.rstrip("/")
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.exit(2, f"--mix: {e}\n")
+    try:
+        options = layout_options(base_url)
+    except (OSError, RuntimeError) as e:
+        parser.exit(1, f"Could not read the layout from {base_url}: {e}\n")
+    if not options.get("microscope"):
+        parser.exit(1, "The app has no records (no microscopes in the filter options).\n")
+
+    rng = random.Random(args.seed)
+    dates = record_dates(base_url) if mix.get("dated") else None
+    images = []
+    if mix.get("images"):
+        images = collect_images(base_url, options, rng, args.image_queries)
+        if not images:
+            print("No images found; leaving out image requests.", file=sys.stderr)
+            mix.pop("images")
+    print(f"{len(options['microscope'])} microscopes, {len(images)} images; "
+          f"{args.concurrency} users for {args.requests or f'{args.duration:g}s'} ...", flush=True)
+
+    kinds, weights = list(mix), list(mix.values())
+    samples = []
+    counter = itertools.count()
+    deadline = time.perf_counter() + args.duration
+
+    def user(number):
+        user_rng = random.Random(f"{args.seed}-{number}")
+        while True:
+            if args.requests is not None:
+                if next(counter) >= args.requests:
+                    return
+            elif time.perf_counter() >= deadline:
+                return
+            kind = user_rng.choices(kinds, weights)[0]
+            if kind == "page":
+                url, payload = f"{base_url}/_dash-layout", None
+            elif kind == "images":
+                url, payload = base_url + user_rng.choice(images), None
+            else:
+                url = f"{base_url}/_dash-update-component"
+                payload = output_payload(random_filters(user_rng, kind, options, dates))
+            start = time.perf_counter()
+            try:
+                status, body = http_request(url, payload)
+                ok, size = 200 <= status < 400, len(body)
+            except OSError:
+                ok, size = False, 0
+            samples.append((kind, ok, time.perf_counter() - start, size))
+
+    threads = [threading.Thread(target=user, args=(i,), daemon=True) for i in range(args.concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    summary = summarize(samples, elapsed)
+    print(f"{'kind':<12}{'requests':>9}{'errors':>8}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'mean KB':>9}{'max KB':>9}")
+    for kind, stats in summary.items():
+        if not stats["requests"]:
+            continue
+        print(f"{kind:<12}{stats['requests']:>9}{stats['errors']:>8}{stats['throughput']:>8.1f}"
+              f"{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}"
+              f"{stats['mean_bytes'] / 1024:>9.1f}{stats['max_bytes'] / 1024:>9.1f}")
+
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump({
+                "url": base_url, "concurrency": args.concurrency, "mix": mix, "seed": args.seed,
+                "elapsed": elapsed, "summary": summary,
+            }, fh, indent=1)
+    if summary["all"]["errors"]:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
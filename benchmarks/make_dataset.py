@@ -0,0 +1,150 @@
+import os
+import io
+import sys
+import random
+import shutil
+import logging
+import argparse
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from log_config import configure_logging
+
+# Synthetic input data for benchmarks and load tests.
+#
+# Builds <root>/data the way the facility stores it: one directory per
+# microscope, one <date>_M<microscope>_O<objective>_T<test>_S<bead_size>_B<bead_number>
+# directory per measurement with a few bead directories, each holding one
+# .xls result and its .jpg images. Test types are mixed as in practice (PSFo
+# in both result layouts, ChromDual, ChromTri), values drift slowly per
+# microscope with noise and the odd outlier, so figures and deviation tables
+# look real. A small share of files is broken on purpose: names outside the
+# naming scheme (unprocessed.txt) and results without the target section
+# (dataless.txt). Legacy THom405 centricity/homogeneity measurements (no bead
+# tokens) are included too; they are recognized but not parsed yet, so they
+# also end up in unprocessed.txt. The same seed always gives the same tree.
+#
+# Use: python3 benchmarks/make_dataset.py -d </path/to/dir> -n <files> [--seed <seed>]
+
+logger = logging.getLogger("make_dataset")
+
+microscopes = ["AndorDragonfly", "LeicaSP8X", "LeicaStellaris", "ZeissLSM880", "ZeissLSM980", "NikonW1"]
+objectives = ["63x1.4", "100x1.45", "40x1.3"]
+# Test type and its share of the files
+tests = [("PSFo", 0.45), ("ChromDual", 0.25), ("ChromTri", 0.25), ("Hom405", 0.05)]
+bead_sizes = ["0.1", "0.2", "1.0"]
+beads_per_measurement = 4
+first_date = date(2022, 1, 3)
+invalid_share = 0.01
+dataless_share = 0.02
+
+
+def jpeg_bytes(size=96):
+    """A small JPEG image (the same for every bead; thumbnails only need a decodable file)"""
+    from PIL import Image
+    image = Image.new("RGB", (size, size))
+    image.putdata([(x * 255 // size, y * 255 // size, 128) for y in range(size) for x in range(size)])
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=80)
+    return buffer.getvalue()
+
+
+def result_text(rng, test, level):
+    """Content of one .xls result with values around level"""
+    def value(scale):
+        outlier = 1.5 if rng.random() < 0.01 else 1.0
+        return abs(rng.gauss(level * scale * outlier, level * scale * 0.04))
+
+    header = "".join(f"Parameter {i}\t{rng.random():.4f}\n" for i in range(20))
+    if test == "PSFo":
+        x, y, z = value(0.21), value(0.21), value(0.62)
+        if rng.random() < 0.5:
+            return f"{header}Measured FWHM\t{x:.4f}\t{y:.4f}\t{z:.4f}\n"
+        return f"{header}FWHM\tMeasured FWHM\nX\t{x:.4f}\nY\t{y:.4f}\nZ\t{z:.4f}\n"
+    if test == "ChromDual":
+        return (f"{header}Uncalibrated distances\nChannel 1\t{value(0.3):.4f} (0.02)\n"
+                f"Calibrated distances\nChannel 1\t{value(0.1):.4f} (0.02)\n")
+    return (f"{header}Calibrated distances\n"
+            f"Channel 1\t{value(0.05):.4f} (0.01)\t{value(0.06):.4f} (0.01)\t{value(0.08):.4f} (0.01)\n")
+
+
+def write_files(data_dir, start, stop, seed=0, images=2):
+    """Write result files number start..stop-1 (with their images) below data_dir; returns counts per kind"""
+    jpeg = jpeg_bytes() if images else None
+    counts = {"records": 0, "dataless": 0, "unprocessed": 0}
+    test_names = [test for test, _ in tests]
+    test_weights = [share for _, share in tests]
+    for measurement in range(start // beads_per_measurement, -(-stop // beads_per_measurement)):
+        # Every measurement and file gets its own generator, so files
+        # start..stop come out the same however the range is split
+        rng = random.Random(f"{seed}-{measurement}")
+        microscope = microscopes[measurement % len(microscopes)]
+        objective = rng.choice(objectives)
+        test = rng.choices(test_names, test_weights)[0]
+        day = first_date + timedelta(days=measurement // len(microscopes))
+        name = f"{day:%Y%m%d}_M{microscope}_O{objective}_T{test}_S{rng.choice(bead_sizes)}_B{rng.randrange(3)}"
+        if test.startswith("Hom"):
+            name = f"{day:%Y%m%d}_M{microscope}_O{objective}_T{test}"
+        # Slow drift per microscope over the days
+        level = 1.0 + 0.1 * ((measurement // len(microscopes)) % 90) / 90 + 0.05 * microscopes.index(microscope)
+
+        for number in range(max(start, measurement * beads_per_measurement),
+                            min(stop, (measurement + 1) * beads_per_measurement)):
+            file_rng = random.Random(f"{seed}-{measurement}-{number}")
+            kind = file_rng.random()
+            # Two-digit year: outside the naming scheme
+            file_name = name[2:] if kind < invalid_share else name
+            bead_dir = f"{data_dir}/{microscope}/{file_name}/bead{number}"
+            os.makedirs(bead_dir, exist_ok=True)
+            dataless = invalid_share <= kind < invalid_share + dataless_share
+            if dataless:
+                text = "".join(f"Parameter {i}\t{file_rng.random():.4f}\n" for i in range(20))
+            else:
+                text = result_text(file_rng, test, level)
+            if kind < invalid_share or test.startswith("Hom"):
+                counts["unprocessed"] += 1
+            else:
+                counts["dataless" if dataless else "records"] += 1
+            with open(f"{bead_dir}/{file_name}_bead{number}.xls", "w") as fh:
+                fh.write(text)
+            for i in range(images):
+                with open(f"{bead_dir}/{file_name}_bead{number}_{i + 1}.jpg", "wb") as fh:
+                    fh.write(jpeg)
+    return counts
+
+
+def make_dataset(root_dir, files, seed=0, images=2, overwrite=False):
+    """Build <root_dir>/data with the given number of result files; returns counts per kind"""
+    data_dir = f"{root_dir}/data"
+    if os.path.exists(data_dir) and os.listdir(data_dir):
+        if not overwrite:
+            raise FileExistsError(f"{data_dir} is not empty")
+        shutil.rmtree(data_dir)
+    os.makedirs(data_dir, exist_ok=True)
+    counts = write_files(data_dir, 0, files, seed, images)
+    logger.info(
+        "Wrote %d files to %s: %d records, %d dataless, %d unprocessed (outside the naming scheme or CenHom).",
+        files, data_dir, counts["records"], counts["dataless"], counts["unprocessed"]
+    )
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic data directory for benchmarks and load tests.")
+    parser.add_argument('-d', '--directory', type=str, required=True, help="Directory to create data/ in.")
+    parser.add_argument('-n', '--files', type=int, default=5000, help="Number of .xls result files (optional, default: 5000).")
+    parser.add_argument('--images', type=int, default=2, help="Images per bead (optional, default: 2).")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed (optional, default: 0).")
+    parser.add_argument('--overwrite', action='store_true', help="Replace an existing, non-empty data/ directory.")
+    args = parser.parse_args()
+
+    configure_logging()
+    try:
+        make_dataset(args.directory, args.files, args.seed, args.images, args.overwrite)
+    except FileExistsError as e:
+        parser.exit(1, f"{e}; use --overwrite to replace it.\n")
+
+
+if __name__ == '__main__':
+    main()
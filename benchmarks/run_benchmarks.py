@@ -0,0 +1,221 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_dir)
+
+from helpers import fetch_df, generate_fig_data, group_stats, RecordsIndex
+from log_config import configure_logging
+from make_dataset import make_dataset, write_files
+from records_store import load_records, load_stats
+
+# Benchmark suite for the whole pipeline.
+#
+# For every dataset size a synthetic data directory is generated
+# (make_dataset.py) and timed through the same steps as in production:
+#   extract_cold / extract_warm / extract_incremental
+#       process_data.py on the new tree, again without changes, and again
+#       after 1% more files were added
+#   html_cold / html_warm
+#       generate_html.py, first run and a run without changes
+#   load_records
+#       reading the extracted records as the app does
+#   fetch_df_scan / fetch_df_index
+#       one filter query per (microscope, objective, test), by scanning the
+#       records and through their RecordsIndex (mean per query)
+#   fig_data_records / fig_data_stats
+#       generate_fig_data for the same queries from the records and from the
+#       statistics cube (mean per query)
+#   group_stats_records / group_stats_stats
+#       the per-date statistics of every (microscope, objective), as
+#       generate_html.py and the drift overview compute them, from the
+#       records and from the statistics cube
+# The scripts run as subprocesses (interpreter start-up included, as for a
+# user); in-process steps report the median of --repeats runs. Results are
+# written as JSON together with the commit they were measured on; --compare
+# prints the change against an earlier results file.
+#
+# Use: python3 benchmarks/run_benchmarks.py [--sizes 1000 5000 20000] [-o results.json] [--compare old.json]
+
+RESULTS_VERSION = 1
+
+logger = logging.getLogger("run_benchmarks")
+
+
+def run_script(name, *args):
+    """Run one of the repo's scripts; returns its wall time in seconds"""
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, f"{repo_dir}/{name}", *args], cwd=repo_dir,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"{name} failed with exit code {result.returncode}:\n{result.stderr[-2000:]}")
+    return elapsed
+
+
+def median_time(func, repeats):
+    """Median wall time of func() over repeats runs"""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def benchmark_size(root_dir, files, seed, workers, repeats):
+    """Timings (seconds) of all steps for one dataset size"""
+    counts = make_dataset(root_dir, files, seed, overwrite=True)
+    fetch_dir = f"{root_dir}/extracted"
+    timings = {}
+
+    timings["extract_cold"] = run_script("process_data.py", "-d", root_dir, "-w", str(workers))
+    timings["extract_warm"] = run_script("process_data.py", "-d", root_dir, "-w", str(workers))
+    write_files(f"{root_dir}/data", files, files + max(1, files // 100), seed)
+    timings["extract_incremental"] = run_script("process_data.py", "-d", root_dir, "-w", str(workers))
+    timings["html_cold"] = run_script("generate_html.py", "-d", root_dir, "-w", str(workers))
+    timings["html_warm"] = run_script("generate_html.py", "-d", root_dir, "-w", str(workers))
+
+    timings["load_records"] = median_time(lambda: load_records(fetch_dir), repeats)
+    df = load_records(fetch_dir)
+    stats = load_stats(fetch_dir)
+    index = RecordsIndex(df)
+    stats_index = RecordsIndex(stats) if stats is not None else None
+    queries = list(df[["microscope", "objective", "test"]].drop_duplicates().itertuples(index=False, name=None))
+
+    def run_queries(func):
+        return median_time(lambda: [func(*query) for query in queries], repeats) / len(queries)
+
+    timings["fetch_df_scan"] = run_queries(lambda m, o, t: fetch_df(df, m, o, t))
+    timings["fetch_df_index"] = run_queries(lambda m, o, t: fetch_df(df, m, o, t, index=index))
+    timings["fig_data_records"] = run_queries(lambda m, o, t: generate_fig_data(df, m, o, t, index=index))
+    timings["group_stats_records"] = median_time(lambda: group_stats(df, ["microscope", "objective"]), repeats)
+    if stats is not None:
+        timings["fig_data_stats"] = run_queries(
+            lambda m, o, t: generate_fig_data(df, m, o, t, index=index, stats=stats, stats_index=stats_index)
+        )
+        timings["group_stats_stats"] = median_time(
+            lambda: group_stats(stats, ["microscope", "objective"], from_stats=True), repeats
+        )
+    else:
+        logger.warning("No up-to-date statistics cube in %s; skipping fig_data_stats and group_stats_stats.", fetch_dir)
+
+    return {
+        "files": files,
+        "records": len(df),
+        "stats_rows": len(stats) if stats is not None else None,
+        "queries": len(queries),
+        "dataless": counts["dataless"],
+        "unprocessed": counts["unprocessed"],
+        "timings": timings,
+    }
+
+
+def git_commit():
+    """(commit hash, whether the working tree has changes), or (None, None) outside a git checkout"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=repo_dir, capture_output=True, text=True, check=True)
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=repo_dir,
+                                capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit.stdout.strip(), bool(status.stdout.strip())
+
+
+def compare_results(old, new, tolerance):
+    """Print the change of every timing against old results; returns the number of regressions beyond tolerance (%)"""
+    old_sizes = {result["files"]: result["timings"] for result in old["results"]}
+    regressions = 0
+    print(f"Compared with {old.get('commit') or 'unknown commit'} ({old.get('timestamp')}):")
+    for result in new["results"]:
+        old_timings = old_sizes.get(result["files"])
+        if old_timings is None:
+            continue
+        for name, seconds in result["timings"].items():
+            before = old_timings.get(name)
+            if not before:
+                continue
+            change = (seconds - before) / before * 100
+            flag = ""
+            if change > tolerance:
+                flag = "  <-- slower"
+                regressions += 1
+            print(f"  {result['files']:>7} files  {name:<20} {before:10.4f}s -> {seconds:10.4f}s  {change:+7.1f}%{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time extraction, queries, figures and HTML generation on synthetic datasets.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000, 20000],
+                        help="Numbers of result files to benchmark (optional, default: 1000 5000 20000).")
+    parser.add_argument('-w', '--workers', type=int, default=4,
+                        help="Workers passed to process_data.py and generate_html.py (optional, default: 4).")
+    parser.add_argument('--repeats', type=int, default=5,
+                        help="Runs of each in-process step; the median is reported (optional, default: 5).")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed of the datasets (optional, default: 0).")
+    parser.add_argument('--work-dir', type=str, default=None,
+                        help="Directory for the datasets (optional, default: a temporary directory, removed afterwards).")
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help="Results file (optional, default: benchmarks/results/<timestamp>_<commit>.json).")
+    parser.add_argument('--compare', type=str, default=None, help="Earlier results file to compare against (optional).")
+    parser.add_argument('--tolerance', type=float, default=20,
+                        help="Slowdown in percent reported as a regression by --compare (optional, default: 20).")
+    args = parser.parse_args()
+
+    configure_logging(logging.WARNING)
+    commit, dirty = git_commit()
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="mcs_bench_")
+
+    results = []
+    try:
+        for files in args.sizes:
+            print(f"Benchmarking {files} files ...", flush=True)
+            result = benchmark_size(f"{work_dir}/n{files}", files, args.seed, args.workers, args.repeats)
+            results.append(result)
+            for name, seconds in result["timings"].items():
+                print(f"  {name:<20} {seconds:10.4f}s")
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "version": RESULTS_VERSION,
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": timestamp,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "workers": args.workers,
+        "repeats": args.repeats,
+        "seed": args.seed,
+        "results": results,
+    }
+    output = args.output or f"{repo_dir}/benchmarks/results/{timestamp}_{(commit or 'nogit')[:10]}.json"
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as fh:
+        json.dump(report, fh, indent=1)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as fh:
+            old = json.load(fh)
+        if compare_results(old, report, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
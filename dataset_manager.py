@@ -0,0 +1,151 @@
+import time
+import logging
+import threading
+import pandas as pd
+
+from helpers import index_columns, ImageIndex, RecordsIndex
+from records_store import (
+    dataset_version, file_version, image_index_path, journal_path, load_image_index, load_records, load_stats,
+    read_stamp, record_columns, records_paths, stats_path
+)
+
+# Hot-reloading of the extracted records for app.py.
+#
+# Everything the app reads for one version of the records (the records, their
+# index, the statistics cube, the image index and the dropdown options) is
+# bundled in a DatasetSnapshot. The DatasetManager holds the current snapshot
+# and, on a background thread, checks every poll_interval seconds whether
+# records.csv, its changelog or one of its derived files changed. A change is
+# only loaded once it has stayed the same for one more interval (so a file
+# that is still being written is not read), into a new snapshot that then
+# replaces the current one in a single assignment. Callbacks take the
+# snapshot once when they start (DatasetManager.current()) and keep using it,
+# so a swap never mixes two versions within one response.
+
+logger = logging.getLogger(__name__)
+
+
+class DatasetSnapshot:
+    def __init__(self, version, df, stats=None, image_index=None):
+        self.version = version
+        self.df = df
+        # Index the records once so each query only touches the rows it returns.
+        self.index = RecordsIndex(df)
+        # Per-date statistics cube written by process_data.py; figures are
+        # combined from it, so the raw rows are only needed for the Data and
+        # Image tabs.
+        self.stats = stats
+        self.stats_index = RecordsIndex(stats) if stats is not None else None
+        self.image_index = image_index if image_index is not None else ImageIndex()
+        self.options = {
+            col: [{'label': item, 'value': item} for item in df[col].unique()]
+            for col in index_columns
+        }
+
+
+def empty_records():
+    """Empty records dataframe with the records.csv columns"""
+    return pd.DataFrame(columns=record_columns).assign(date=lambda x: pd.to_datetime(x['date']))
+
+
+def source_version(fetch_dir):
+    """Versions of the files a snapshot is loaded from: records.csv and its changelog, the stamps of the derived
+    copies and images.json with its journal"""
+    _, dataset_dir = records_paths(fetch_dir)
+    index_file = image_index_path(fetch_dir)
+    return (
+        dataset_version(fetch_dir), read_stamp(dataset_dir), read_stamp(stats_path(fetch_dir)),
+        file_version(index_file), file_version(journal_path(index_file))
+    )
+
+
+def load_snapshot(fetch_dir, revalidate_images=False):
+    """Load a snapshot of the extracted records; raises if the records cannot be read"""
+    # Version of the records that df is loaded from; cached figures are only
+    # reused for the same version. Taken before loading, so a change during
+    # the load is picked up by the next check.
+    version = dataset_version(fetch_dir)
+
+    # load_records reads the typed Parquet copy when it is current (dates
+    # already parsed) and only falls back to parsing records.csv otherwise.
+    # The app deliberately loads every partition and column: the dropdowns
+    # list all values, and each Submit or export is answered from the
+    # in-memory RecordsIndex instead of re-reading the share. load_records'
+    # column projection and filter pushdown are for the command-line readers
+    # (generate_html.py, drift_report.py) and scripts.
+    df = load_records(fetch_dir)
+    if df.empty:
+        logger.warning("records.csv has no data rows; the filters will be empty.")
+
+    stats = load_stats(fetch_dir)
+    if stats is None:
+        logger.info("No up-to-date statistics cube; figures are computed from the records.")
+
+    # Bead images per data directory, recorded during extraction
+    image_index = ImageIndex(load_image_index(fetch_dir), revalidate=revalidate_images)
+    return DatasetSnapshot(version, df, stats, image_index)
+
+
+class DatasetManager:
+    def __init__(self, fetch_dir, poll_interval=30, revalidate_images=False):
+        self.fetch_dir = fetch_dir
+        self.poll_interval = poll_interval
+        self.revalidate_images = revalidate_images
+        self._source = source_version(fetch_dir)
+        self._pending = None
+        self._thread = None
+
+        # Load defensively so the web app still starts (with empty filters)
+        # even if extraction produced no/invalid data.
+        try:
+            self.snapshot = load_snapshot(fetch_dir, revalidate_images)
+        except FileNotFoundError:
+            logger.error("records.csv not found in %s; starting with an empty dataset.", fetch_dir)
+            self.snapshot = DatasetSnapshot(None, empty_records())
+        except Exception:
+            logger.exception("Failed to read records from %s; starting with an empty dataset.", fetch_dir)
+            self.snapshot = DatasetSnapshot(None, empty_records())
+
+    def current(self):
+        """The current snapshot; use the returned object for the whole request"""
+        return self.snapshot
+
+    def check(self):
+        """Swap in a new snapshot if the files changed and have settled since the last check; returns True if swapped"""
+        source = source_version(self.fetch_dir)
+        if source == self._source:
+            self._pending = None
+            return False
+        if source != self._pending:
+            # Changed since the last check: wait one more interval
+            self._pending = source
+            return False
+
+        self._source = source
+        self._pending = None
+        try:
+            snapshot = load_snapshot(self.fetch_dir, self.revalidate_images)
+        except Exception:
+            logger.exception("Could not reload records from %s; keeping the current dataset.", self.fetch_dir)
+            return False
+        self.snapshot = snapshot
+        logger.info(
+            "Reloaded dataset (version %s, %d records, statistics cube: %s).",
+            snapshot.version, len(snapshot.df), "yes" if snapshot.stats is not None else "no"
+        )
+        return True
+
+    def start(self):
+        """Start checking for new records in the background (no-op if poll_interval <= 0 or already started)"""
+        if self.poll_interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="dataset-manager", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Dataset check failed; keeping the current dataset.")
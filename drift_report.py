@@ -0,0 +1,70 @@
+import pandas as pd
+import logging
+import argparse
+import sys
+from helpers import drift_overview, index_columns
+from log_config import configure_logging
+from records_store import load_records, load_stats, record_columns
+
+# Fleet-wide drift report: for every (microscope, objective, test, bead_size,
+# bead_number) group (or a coarser grouping with --by), the last date is
+# compared against the mean of the previous --consider-limit dates, exactly as
+# in the app's deviation table, and groups deviating by more than
+# --warning-percentage are listed first. Computed in one vectorised pass over
+# the statistics cube (helpers.drift_overview).
+
+logger = logging.getLogger("drift_report")
+
+
+def main():
+    # Use: python3 drift_report.py -d </path/to/dir> [-o report.csv]
+    parser = argparse.ArgumentParser(description="Report the drift of every group against its previous dates.")
+    parser.add_argument('-d', '--directory', type=str, default="/mcs_bead_project", help="Path to the directory (optional).")
+    parser.add_argument('--by', nargs='+', choices=index_columns, default=index_columns,
+                        help="Columns defining a group (optional, default: all five).")
+    parser.add_argument('--consider-limit', type=int, default=3,
+                        help="Previous dates the last date is compared against (optional, default: 3).")
+    parser.add_argument('--warning-percentage', type=float, default=15,
+                        help="Deviation in percent that marks a group red (optional, default: 15).")
+    parser.add_argument('--warnings-only', action='store_true', help="Only list groups with a warning.")
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help="Write the report to this CSV file instead of printing it (optional).")
+    args = parser.parse_args()
+
+    extracted_dir = f"{args.directory}/extracted"
+    configure_logging()
+
+    # Use the statistics cube when it is up to date, otherwise the records
+    stats = load_stats(extracted_dir)
+    if stats is not None:
+        df = stats
+    else:
+        logger.info("No up-to-date statistics cube; computing the report from the records.")
+        try:
+            df = load_records(extracted_dir, columns=[c for c in record_columns if c != "file_path"])
+        except FileNotFoundError:
+            # Exit status 2 (not 1): there is nothing to report on yet
+            parser.exit(2, f"No extracted records in {extracted_dir}; run process_data.py first.\n")
+
+    report = drift_overview(
+        df, by=args.by, consider_limit=args.consider_limit,
+        warning_percentage=args.warning_percentage, from_stats=stats is not None
+    )
+    warnings = int(report['warning'].sum())
+    logger.info("Drift report: %d groups, %d with warnings.", len(report), warnings)
+    if args.warnings_only:
+        report = report[report['warning']]
+
+    if args.output:
+        report.to_csv(args.output, index=False, date_format='%Y%m%d')
+    else:
+        report = report.drop(columns=['warning']).assign(last_date=lambda x: x['last_date'].dt.strftime('%Y-%m-%d'))
+        with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', None):
+            print(report.round(2).to_string(index=False))
+
+    # Exit status 1 when any group drifts, for cron/CI checks
+    return 1 if warnings else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
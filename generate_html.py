@@ -1,50 +1,45 @@
 import pandas as pd
 # import plotly.express as px
+import plotly
 import plotly.io as pio
 # from datetime import datetime
 import logging
-from helpers import generate_fig_data
+import argparse
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
+from helpers import generate_group_fig_data
 from log_config import configure_logging
+from records_store import load_records, load_stats, record_columns
 import shutil
 import os
 
-extracted_dir = '/mcs_bead_project/extracted'
-record_file = f"{extracted_dir}/records.csv"
-html_dir = f"{extracted_dir}/html"
-html_all_file = f"{extracted_dir}/figures.html"
+# Figures are rendered incrementally: the per-date statistics of every
+# (microscope, objective) group are computed in one grouped pass
+# (helpers.generate_group_fig_data), each group's statistics are hashed together with the
+# render parameters, and only groups whose hash changed since the last run
+# are rendered again (in a process pool). Each rendered figure + deviation table is kept as an HTML fragment in
+# html/.fragments/, from which both the per-figure pages and figures.html are
+# assembled, in sorted group order. Bump RENDER_VERSION whenever the output
+# format below changes so every figure is rendered again.
+#
+# plotly.js (several MB) is not embedded in the fragments. By default one
+# local copy is written to html/plotly.min.js and every page loads it from
+# there (the lab network has no CDN access); --plotlyjs cdn loads it from the
+# CDN instead.
+RENDER_VERSION = 3
+plotlyjs_file = "plotly.min.js"
+plotlyjs_cdn = "https://cdn.plot.ly/plotly-latest.min.js"
 
-configure_logging()
 logger = logging.getLogger("generate_html")
-logger.info("Starting HTML generation")
-
-# Delete existing html files
-try:
-    shutil.rmtree(html_dir)
-    os.makedirs(html_dir)
-except Exception as e:
-    pass
-
-# Get dataframe
-try:
-    df = pd.read_csv(record_file)
-    df = df.assign(date=lambda x: pd.to_datetime(x['date'], format='%Y%m%d', errors='coerce'))
-except Exception:
-    logger.exception("Could not read %s; writing empty figures and continuing.", record_file)
-    df = pd.DataFrame(columns=["date", "microscope", "objective"])
-
-# Generate html
-microscope_list = df['microscope'].unique()
 
 # All figures in one html.
-# Stream figures straight to the file as they are generated rather than
-# accumulating them in one big in-memory string: this file grows with the
-# dataset, so holding it all in memory was an unbounded memory consumer.
 html_header = """
 <!DOCTYPE html>
 <html>
 <head>
     <title>Microscopy Bead Project Figures</title>
-    <script src="https://cdn.plot.ly/plotly-latest.min.js"></script>
+    <script src="{plotlyjs_src}"></script>
 </head>
 <body>
     <h1>Microscopy Bead Project</h1><br>
@@ -55,87 +50,250 @@ html_footer = """
 </html>
 """
 
-# Open the combined figures.html once for streaming writes. If it can't be
-# opened we still generate the individual per-figure files below.
-try:
-    html_all_fh = open(html_all_file, "w")
-    html_all_fh.write(html_header)
-except Exception:
-    logger.exception("Could not open %s for writing; continuing without combined HTML.", html_all_file)
-    html_all_fh = None
-
-# Loop over the perameters
-processed = 0
-skipped = 0
-for microscope in microscope_list:
-    m_df = df[df['microscope'] == microscope]
-    objective_list = m_df['objective'].unique()
-    for objective in objective_list:
-        try:
-            fig, considerd_df, change_df, fig_name, warning = generate_fig_data(df, microscope, objective)
 
-            # Skip combinations that produced no usable figure/data instead of
-            # crashing the whole stage (this was the cause of the container
-            # exiting partway through generating HTML).
-            if fig is None or change_df is None:
-                logger.warning(
-                    "No usable figure for microscope=%s objective=%s; skipping.",
-                    microscope, objective
-                )
-                skipped += 1
-                continue
+def group_hash(part, params):
+    """Content hash of one group's input rows and the render parameters"""
+    h = hashlib.sha256(json.dumps(params, sort_keys=True).encode())
+    h.update(",".join(part.columns).encode())
+    h.update(pd.util.hash_pandas_object(part, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
 
-            # Create an HTML table from the DataFrame
-            table_html = change_df.to_html(index=False)
+def render_group(render, consider_limit, warning_percentage):
+    """Render one group with its generate_group_fig_data render function; returns (fig_name, HTML fragment), or None if there is no usable figure"""
+    # Skip combinations without any values instead of crashing the whole
+    # stage (this was the cause of the container exiting partway through
+    # generating HTML); other failures are raised and logged per group.
+    result = render(consider_limit, warning_percentage)
+    if result is None:
+        return None
 
-            # Get the Plotly figure HTML
-            figure_html = pio.to_html(fig, full_html=False)
+    fig, change_df, fig_name, warning = result
 
-            # Combine the figure and table into a single HTML document
-            html_content = f"""
+    # Create an HTML table from the DataFrame
+    table_html = change_df.to_html(index=False)
+
+    # Get the Plotly figure HTML (plotly.js itself is loaded once per page)
+    figure_html = pio.to_html(fig, full_html=False, include_plotlyjs=False)
+
+    fragment = f"<div>{figure_html}</div><h4>Deviation Table</h4><div>{table_html}</div>"
+    return fig_name, fragment
+
+
+def figure_page(fragment, plotlyjs_src):
+    """Standalone HTML page for one figure + deviation table fragment"""
+    return f"""
         <!DOCTYPE html>
         <html>
         <head>
             <title>Figure with Deviation Table</title>
-            <script src="https://cdn.plot.ly/plotly-latest.min.js"></script>
+            <script src="{plotlyjs_src}"></script>
         </head>
         <body>
-            <div>{figure_html}</div>
-            <h4>Deviation Table</h4>
-            <div>{table_html}</div>
+            {fragment}
         </body>
         </html>
         """
 
-            # Write the combined HTML to a file
-            with open(f"{html_dir}/{fig_name}.html", "w") as f:
-                f.write(html_content)
-
-            # Stream this figure into the combined HTML instead of holding the
-            # whole document in memory. Both strings are already built above, so
-            # we never write a partially-rendered figure.
-            if html_all_fh is not None:
-                html_all_fh.write(f"<div>{figure_html}</div>")
-                html_all_fh.write("<h4>Deviation Table</h4>")
-                html_all_fh.write(f"<div>{table_html}</div>")
-            processed += 1
+
+def write_file(path, content):
+    """Write a text file through a temp file + rename"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def write_plotlyjs(path):
+    """Write the bundled plotly.js to path unless a copy of it is already there"""
+    from plotly.offline import get_plotlyjs
+
+    content = get_plotlyjs()
+    # Bundles of different plotly versions differ in size; comparing sizes
+    # avoids reading the whole file back from the share on every run.
+    try:
+        if os.path.getsize(path) == len(content.encode()):
+            return
+    except OSError:
+        pass
+    write_file(path, content)
+
+
+def load_html_manifest(path):
+    """Figures rendered by the last run: {group key: {"hash", "fig_name"}}"""
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.warning("Could not read %s (rendering all figures): %s", path, e)
+        return {}
+
+
+def main():
+    # Use: python3 generate_html.py -d </path/to/dir> -w <workers>
+    parser = argparse.ArgumentParser(description="Generate the figure HTML files from the extracted records.")
+    parser.add_argument('-d', '--directory', type=str, default="/mcs_bead_project", help="Path to the directory (optional).")
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1,
+                        help="Number of figures rendered in parallel (optional, default: number of CPUs).")
+    parser.add_argument('--consider-limit', type=int, default=3,
+                        help="Previous dates the last date is compared against (optional, default: 3).")
+    parser.add_argument('--warning-percentage', type=float, default=15,
+                        help="Deviation in percent that marks a figure red (optional, default: 15).")
+    parser.add_argument('--plotlyjs', choices=['local', 'cdn'], default='local',
+                        help="Load plotly.js from one local copy in html/ (default) or from the CDN.")
+    args = parser.parse_args()
+
+    extracted_dir = f"{args.directory}/extracted"
+    html_dir = f"{extracted_dir}/html"
+    fragment_dir = f"{html_dir}/.fragments"
+    html_manifest_file = f"{html_dir}/manifest.json"
+    html_all_file = f"{extracted_dir}/figures.html"
+    workers = max(1, args.workers)
+
+    configure_logging()
+    logger.info("Starting HTML generation")
+    os.makedirs(fragment_dir, exist_ok=True)
+
+    # Where pages load plotly.js from: figures.html sits next to html/
+    if args.plotlyjs == 'local':
+        try:
+            write_plotlyjs(f"{html_dir}/{plotlyjs_file}")
+        except Exception:
+            logger.exception("Could not write %s/%s; figures will not display.", html_dir, plotlyjs_file)
+        page_plotlyjs_src, all_plotlyjs_src = plotlyjs_file, f"html/{plotlyjs_file}"
+    else:
+        page_plotlyjs_src = all_plotlyjs_src = plotlyjs_cdn
+
+    # Get dataframe
+    # Figures only need per-date statistics: use the statistics cube written by
+    # process_data.py when it is up to date, otherwise the records (without
+    # file_path, which figures never use).
+    stats = load_stats(extracted_dir)
+    if stats is not None:
+        df = stats
+    else:
+        logger.info("No up-to-date statistics cube; computing figures from the records.")
+        try:
+            df = load_records(extracted_dir, columns=[c for c in record_columns if c != "file_path"])
         except Exception:
-            logger.exception(
-                "Failed to build figure for microscope=%s objective=%s; skipping.",
-                microscope, objective
-            )
-            skipped += 1
-            continue
+            logger.exception("Could not read records from %s; writing empty figures and continuing.", extracted_dir)
+            df = pd.DataFrame(columns=["date", "microscope", "objective"])
 
-logger.info("HTML generation: %d figures written, %d skipped.", processed, skipped)
+    params = {
+        "render_version": RENDER_VERSION,
+        "plotly": plotly.__version__,
+        "consider_limit": args.consider_limit,
+        "warning_percentage": args.warning_percentage,
+        "plotlyjs": args.plotlyjs,
+    }
 
-# Close out the combined figures.html (write footer, then close the handle).
-if html_all_fh is not None:
+    # Aggregate all groups in one pass, then decide per group whether it has
+    # to be rendered again
     try:
-        html_all_fh.write(html_footer)
+        groups = list(generate_group_fig_data(df, ['microscope', 'objective'], from_stats=stats is not None))
     except Exception:
-        logger.exception("Could not finish writing %s; continuing.", html_all_file)
-    finally:
-        html_all_fh.close()
+        logger.exception("Could not compute figure statistics; writing empty figures and continuing.")
+        groups = []
+    previous = load_html_manifest(html_manifest_file)
+    manifest = {}
+    to_render = {}
+    for (microscope, objective), part, render in groups:
+        key = f"{microscope}\t{objective}"
+        digest = group_hash(part, params)
+        entry = previous.get(key)
+        if entry is not None and entry["hash"] == digest and (
+            entry["fig_name"] is None or os.path.exists(f"{fragment_dir}/{entry['fig_name']}.html")
+        ):
+            manifest[key] = entry
+        else:
+            to_render[key] = (microscope, objective, render, digest)
+
+    rendered = 0
+    failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            key: executor.submit(render_group, render, args.consider_limit, args.warning_percentage)
+            for key, (microscope, objective, render, digest) in to_render.items()
+        }
+        for key, future in futures.items():
+            microscope, objective, render, digest = to_render[key]
+            try:
+                result = future.result()
+            except Exception:
+                logger.exception(
+                    "Failed to build figure for microscope=%s objective=%s; skipping.",
+                    microscope, objective
+                )
+                failed += 1
+                continue
+
+            if result is None:
+                logger.warning(
+                    "No usable figure for microscope=%s objective=%s; skipping.",
+                    microscope, objective
+                )
+                manifest[key] = {"hash": digest, "fig_name": None}
+                continue
+
+            fig_name, fragment = result
+            try:
+                write_file(f"{fragment_dir}/{fig_name}.html", fragment)
+                write_file(f"{html_dir}/{fig_name}.html", figure_page(fragment, page_plotlyjs_src))
+            except Exception:
+                logger.exception("Could not write figure %s; skipping.", fig_name)
+                failed += 1
+                continue
+            manifest[key] = {"hash": digest, "fig_name": fig_name}
+            rendered += 1
+
+    # Remove the files of figures that no longer exist (or have no usable data)
+    current_names = {entry["fig_name"] for entry in manifest.values()}
+    removed = 0
+    for entry in previous.values():
+        fig_name = entry.get("fig_name")
+        if fig_name is not None and fig_name not in current_names:
+            for path in (f"{fragment_dir}/{fig_name}.html", f"{html_dir}/{fig_name}.html"):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except Exception as e:
+                    logger.warning("Could not remove stale figure %s: %s", path, e)
+            removed += 1
+
+    try:
+        write_file(html_manifest_file, json.dumps(manifest))
+    except Exception:
+        logger.exception("Could not write %s; all figures will be rendered next time.", html_manifest_file)
+
+    written = sum(1 for entry in manifest.values() if entry["fig_name"] is not None)
+    logger.info(
+        "HTML generation: %d figures (%d rendered, %d unchanged), %d without usable data, %d failed, %d removed.",
+        written, rendered, written - rendered, len(manifest) - written, failed, removed
+    )
+
+    # Assemble the combined figures.html from the fragments in group order.
+    # Fragments are streamed one at a time rather than accumulated in one big
+    # in-memory string: this file grows with the dataset.
+    tmp_file = f"{html_all_file}.tmp"
+    try:
+        with open(tmp_file, "w") as html_all_fh:
+            html_all_fh.write(html_header.format(plotlyjs_src=all_plotlyjs_src))
+            for key in sorted(manifest):
+                fig_name = manifest[key]["fig_name"]
+                if fig_name is None:
+                    continue
+                with open(f"{fragment_dir}/{fig_name}.html") as fh:
+                    shutil.copyfileobj(fh, html_all_fh)
+            html_all_fh.write(html_footer)
+        os.replace(tmp_file, html_all_file)
+    except Exception:
+        logger.exception("Could not write %s; continuing.", html_all_file)
+
+    logger.info("Finished generating HTML")
+
 
-logger.info("Finished generating HTML")
\ No newline at end of file
+if __name__ == '__main__':
+    main()
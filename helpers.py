@@ -1,23 +1,84 @@
 import os
+import hashlib
 import glob
 import logging
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+import numpy as np
 import pandas as pd
 import plotly.express as px
 from datetime import datetime
+from records_store import metric_columns
 
 logger = logging.getLogger(__name__)
 
 
-# Filter dataframe
-# Return: filtered dataframe
-def fetch_df(df, microscope=None, objective=None, test=None, bead_size=None, bead_number=None, start_date=None, end_date=None):
-    # filter df by date if provided
+# Columns fetch_df can filter on by equality
+index_columns = ['microscope', 'objective', 'test', 'bead_size', 'bead_number']
+
+
+def _date_range(start_date, end_date):
+    """Parsed (start, end) if both dates are valid 'YYYY-MM-DD' strings, otherwise None"""
     try:
         if datetime.strptime(start_date, '%Y-%m-%d') and datetime.strptime(end_date, '%Y-%m-%d'):
-            df = df[(df['date'] >= start_date) & (df['date'] <= end_date)]
+            return pd.Timestamp(start_date), pd.Timestamp(end_date)
     except Exception:
-        # No/invalid date range supplied: keep df unfiltered by date.
+        # No/invalid date range supplied: no date filtering.
         pass
+    return None
+
+
+# Prebuilt index over a loaded records dataframe
+# Maps each (microscope, objective, test, bead_size, bead_number) combination
+# to its row positions, sorted by date so a date range is two binary searches.
+# A query then costs one pass over the (few hundred) combinations plus the
+# rows it returns, instead of a full-length boolean mask per filter. The index
+# belongs to one dataframe and must be rebuilt whenever the data is reloaded.
+class RecordsIndex:
+    def __init__(self, df):
+        self.df = df
+        self.groups = {}
+        if df.empty:
+            return
+        dates = df['date'].to_numpy(dtype='datetime64[ns]')
+        for key, positions in df.groupby(index_columns, dropna=False, sort=False).indices.items():
+            order = np.argsort(dates[positions], kind='stable')
+            self.groups[key] = (dates[positions][order], positions[order])
+
+    def positions(self, microscope=None, objective=None, test=None, bead_size=None, bead_number=None, start_date=None, end_date=None):
+        """Sorted row positions matching the filters (same semantics as fetch_df)"""
+        values = (microscope, objective, test, bead_size, bead_number)
+        date_range = _date_range(start_date, end_date)
+        if date_range is not None:
+            start, end = (np.datetime64(d, 'ns') for d in date_range)
+
+        matched = []
+        for key, (dates, positions) in self.groups.items():
+            if any(value is not None and key_value != value for key_value, value in zip(key, values)):
+                continue
+            if date_range is not None:
+                # NaT sorts last, so it is never inside [start, end]
+                positions = positions[np.searchsorted(dates, start, 'left'):np.searchsorted(dates, end, 'right')]
+            matched.append(positions)
+
+        if not matched:
+            return np.array([], dtype=np.intp)
+        return np.sort(np.concatenate(matched))
+
+
+# Filter dataframe
+# Uses the prebuilt RecordsIndex of df when one is given, otherwise scans df
+# Return: filtered dataframe
+def fetch_df(df, microscope=None, objective=None, test=None, bead_size=None, bead_number=None, start_date=None, end_date=None, index=None):
+    if index is not None and index.df is df:
+        return df.iloc[index.positions(microscope, objective, test, bead_size, bead_number, start_date, end_date)]
+
+    # filter df by date if provided
+    date_range = _date_range(start_date, end_date)
+    if date_range is not None:
+        df = df[(df['date'] >= date_range[0]) & (df['date'] <= date_range[1])]
     if microscope is not None:
         df = df[df['microscope'] == microscope]
     if objective is not None:
@@ -32,116 +93,352 @@ def fetch_df(df, microscope=None, objective=None, test=None, bead_size=None, bea
     return df
 
 
-# Generate figure, considered value and warning
-# Return: figure, data, change, title, warning
-def generate_fig_data(df, microscope=None, objective=None, test=None, bead_size=None, bead_number=None, start_date=None, end_date=None, consider_limit=3, warning_percentage=15):
-    try:
-        # fetch dataframe
-        fdf = fetch_df(df, microscope, objective, test, bead_size, bead_number, start_date, end_date)
-        if fdf.empty:
-            return None, None, None, None, None
-
-        # defined values
-        columns_to_mean = ['far_red', 'red', 'uv', 'dual', 'x', 'y', 'z']
-        warning = False
-        sd_data = []
-        color_map = {
-            'far_red': 'orange',
-            'red': 'red',
-            'uv': 'blue',
-            'dual': 'green',
-            'x': 'purple',
-            'y': 'cyan',
-            'z': 'magenta'
-        }
-
-        # get fig name
-        fig_name = "FIG"
-        fig_name += f"_{microscope}" if microscope else ""
-        fig_name += f"_{objective}" if objective else ""
-        fig_name += f"_{test}" if test else ""
-        fig_name += f"_{str(start_date)}" if start_date else ""
-        fig_name += f"_{str(end_date)}" if end_date else ""
+# Filters of a request from its query string arguments (e.g. an export URL)
+# Values are converted to the type of their column in df, so a bead_size of
+# "1.0" matches the float 1.0 the records hold; values that do not convert
+# raise ValueError. Missing or empty arguments are no filter, dates stay
+# 'YYYY-MM-DD' strings as fetch_df expects.
+# Return: dict of fetch_df filter arguments
+def request_filters(args, df):
+    filters = {}
+    for col in index_columns:
+        value = args.get(col)
+        if value is None or value == '':
+            value = None
+        elif pd.api.types.is_integer_dtype(df[col].dtype):
+            number = float(value)
+            if not number.is_integer():
+                raise ValueError(f"{col} must be an integer, got {value!r}")
+            value = int(number)
+        elif pd.api.types.is_float_dtype(df[col].dtype):
+            value = float(value)
+        filters[col] = value
+    for col in ('start_date', 'end_date'):
+        value = args.get(col) or None
+        if value is not None:
+            datetime.strptime(value, '%Y-%m-%d')
+        filters[col] = value
+    return filters
 
-        # get mean and deviation
-        columns_to_mean = [col for col in columns_to_mean if not fdf[col].isna().all()]
-        stats_df = fdf[['date'] + columns_to_mean].groupby('date').agg(['mean', 'std']).reset_index()
-        stats_df.columns = ['_'.join(col).strip('_') if isinstance(col, tuple) else col for col in stats_df.columns]
-
-        for col in columns_to_mean:
-            sd_data.append({
-                'date': stats_df['date'],
-                'mean': stats_df[f'{col}_mean'],
-                'std': stats_df[f'{col}_std'],
-                'metric': col
-            })
-
-        proc_df = pd.concat(
-            [pd.DataFrame(err) for err in sd_data],
-            axis=0
-        ).reset_index(drop=True)
-
-        # sort the DataFrame by date to identify the most recent dates
-        stats_df = stats_df.sort_values('date')
-
-        # identify the last date and the earlier available dates
-        last_date = stats_df['date'].max()
-        available_dates = stats_df['date'].unique()
-        num_earlier_dates = min(consider_limit, len(available_dates) - 1)  # Use up to consider_limit dates or all available earlier dates
-
-        # select the earlier dates
-        earlier_dates = stats_df['date'].nlargest(num_earlier_dates + 1).iloc[1:]
-
-        # filter data for the earlier dates
-        last_n_data = stats_df[stats_df['date'].isin(earlier_dates)]
-
-        # calculate the mean for the selected earlier dates
-        last_n_mean = last_n_data[[f'{col}_mean' for col in columns_to_mean]].mean()
-
-        # get the last date's values
-        last_date_data = stats_df[stats_df['date'] == last_date]
-        last_date_values = last_date_data[[f'{col}_mean' for col in columns_to_mean]].values[0]
-
-        # calculate the percentage change
-        percentage_change = (last_date_values - last_n_mean.values) / last_n_mean.values * 100
-
-        # create a result DataFrame
-        change_df = pd.DataFrame({
-            'Metric': columns_to_mean,
-            f"Up To {consider_limit} Dates Mean": last_n_mean.values,
-            'Last Date Mean': last_date_values,
-            'Percentage Change (%)': percentage_change
+
+# Per-date mean, std and count of every metric, for every group of `by`, in
+# one grouped pass. df is either raw records or, with from_stats=True, rows of
+# the statistics cube (see records_store.build_stats_cube); cube rows are
+# pooled into the same values groupby(...).agg(['mean', 'std']) on the
+# underlying records would give: counts and means pool directly, and the
+# sample variance follows from the pooled sums of squares. Rows without a
+# valid date or group key are left out.
+# Return: dataframe with the `by` columns, date, <col>_mean, <col>_std and
+# <col>_count, sorted by group and date
+def group_stats(df, by=(), from_stats=False):
+    keys = list(by) + ['date']
+    if not from_stats:
+        stats_df = df.groupby(keys, sort=True)[metric_columns].agg(['mean', 'std', 'count'])
+        stats_df.columns = [f'{col}_{stat}' for col, stat in stats_df.columns]
+        return stats_df.reset_index()
+
+    # All metrics at once: (rows x metrics) arrays of count, sum and sum of
+    # squares, summed per group in a single groupby
+    n = df[[f'{col}_count' for col in metric_columns]].to_numpy(dtype=float)
+    mean = np.nan_to_num(df[[f'{col}_mean' for col in metric_columns]].to_numpy(dtype=float))
+    std = np.nan_to_num(df[[f'{col}_std' for col in metric_columns]].to_numpy(dtype=float))
+    values = np.hstack([n, n * mean, np.clip(n - 1, 0, None) * std ** 2 + n * mean ** 2])
+    grouped = pd.DataFrame(values, index=pd.MultiIndex.from_frame(df[keys])).groupby(level=keys, sort=True).sum()
+
+    width = len(metric_columns)
+    sums = grouped.to_numpy()
+    total_n, total, total_sq = sums[:, :width], sums[:, width:2 * width], sums[:, 2 * width:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pooled_mean = np.where(total_n > 0, total / total_n, np.nan)
+        pooled_var = np.where(total_n > 1, (total_sq - total_n * pooled_mean ** 2) / (total_n - 1), np.nan)
+    pooled_std = np.sqrt(np.clip(pooled_var, 0, None))
+    columns = {}
+    for i, col in enumerate(metric_columns):
+        columns[f'{col}_mean'] = pooled_mean[:, i]
+        columns[f'{col}_std'] = pooled_std[:, i]
+        columns[f'{col}_count'] = total_n[:, i].astype(np.int64)
+    return pd.DataFrame(columns, index=grouped.index).reset_index()
+
+
+# Figure name for a query
+# Return: str
+def get_fig_name(microscope=None, objective=None, test=None, start_date=None, end_date=None):
+    fig_name = "FIG"
+    fig_name += f"_{microscope}" if microscope else ""
+    fig_name += f"_{objective}" if objective else ""
+    fig_name += f"_{test}" if test else ""
+    fig_name += f"_{str(start_date)}" if start_date else ""
+    fig_name += f"_{str(end_date)}" if end_date else ""
+    return fig_name
+
+
+# Line colour of every metric in the figures
+metric_colors = {
+    'far_red': 'orange',
+    'red': 'red',
+    'uv': 'blue',
+    'dual': 'green',
+    'x': 'purple',
+    'y': 'cyan',
+    'z': 'magenta'
+}
+
+
+# Build figure, deviation table and warning from per-date statistics
+# (one group's rows of group_stats)
+# Return: figure, change, warning
+def fig_data_from_stats(stats_df, fig_name, test=None, consider_limit=3, warning_percentage=15):
+    # defined values
+    columns_to_mean = [col for col in metric_columns if stats_df[f'{col}_count'].sum() > 0]
+    warning = False
+    sd_data = []
+
+    for col in columns_to_mean:
+        sd_data.append({
+            'date': stats_df['date'],
+            'mean': stats_df[f'{col}_mean'],
+            'std': stats_df[f'{col}_std'],
+            'metric': col
         })
 
-        # check if the percentage change is more than warning_percentage
-        significant_changes = change_df[change_df['Percentage Change (%)'].abs() > warning_percentage]
-        warning = True if not significant_changes.empty else False
+    proc_df = pd.concat(
+        [pd.DataFrame(err) for err in sd_data],
+        axis=0
+    ).reset_index(drop=True)
 
-        if warning:
-            title_content = f"🔴🔴🔴 {fig_name} 🔴🔴🔴"
-        else:
-            title_content = f"🟢🟢🟢 {fig_name} 🟢🟢🟢"
-
-        mean_label = "FWHM µm" if test == "PSFo" else "Distance in µm"
-        # generate figure
-        fig = px.line(
-            proc_df,
-            x='date',
-            y='mean',
-            error_y='std',
-            color='metric',
-            color_discrete_map=color_map,
-            labels={'mean': mean_label, 'date': 'Date', 'metric': 'Metric'},
-            markers=True
+    # sort the DataFrame by date to identify the most recent dates
+    stats_df = stats_df.sort_values('date')
+
+    # identify the last date and the earlier available dates
+    last_date = stats_df['date'].max()
+    available_dates = stats_df['date'].unique()
+    num_earlier_dates = min(consider_limit, len(available_dates) - 1)  # Use up to consider_limit dates or all available earlier dates
+
+    # select the earlier dates
+    earlier_dates = stats_df['date'].nlargest(num_earlier_dates + 1).iloc[1:]
+
+    # filter data for the earlier dates
+    last_n_data = stats_df[stats_df['date'].isin(earlier_dates)]
+
+    # calculate the mean for the selected earlier dates
+    last_n_mean = last_n_data[[f'{col}_mean' for col in columns_to_mean]].mean()
+
+    # get the last date's values
+    last_date_data = stats_df[stats_df['date'] == last_date]
+    last_date_values = last_date_data[[f'{col}_mean' for col in columns_to_mean]].values[0]
+
+    # calculate the percentage change
+    percentage_change = (last_date_values - last_n_mean.values) / last_n_mean.values * 100
+
+    # create a result DataFrame
+    change_df = pd.DataFrame({
+        'Metric': columns_to_mean,
+        f"Up To {consider_limit} Dates Mean": last_n_mean.values,
+        'Last Date Mean': last_date_values,
+        'Percentage Change (%)': percentage_change
+    })
+
+    # check if the percentage change is more than warning_percentage
+    significant_changes = change_df[change_df['Percentage Change (%)'].abs() > warning_percentage]
+    warning = True if not significant_changes.empty else False
+
+    if warning:
+        title_content = f"🔴🔴🔴 {fig_name} 🔴🔴🔴"
+    else:
+        title_content = f"🟢🟢🟢 {fig_name} 🟢🟢🟢"
+
+    mean_label = "FWHM µm" if test == "PSFo" else "Distance in µm"
+    # generate figure
+    fig = px.line(
+        proc_df,
+        x='date',
+        y='mean',
+        error_y='std',
+        color='metric',
+        color_discrete_map=metric_colors,
+        labels={'mean': mean_label, 'date': 'Date', 'metric': 'Metric'},
+        markers=True
+    )
+
+    fig.update_layout(
+        title=dict(
+            text=title_content,
+            x=0.5,  # Center align
+            xanchor='center'
         )
+    )
+
+    return fig, change_df, warning
 
-        fig.update_layout(
-            title=dict(
-                text=title_content,
-                x=0.5,  # Center align
-                xanchor='center'
-            )
+
+# Figure, deviation table, title and warning of one group from its per-date
+# statistics (a slice of group_stats); filters are the group's `by` values.
+# Return: figure, change, title, warning (None if the group has no values)
+def render_group_fig_data(stats_df, filters, consider_limit=3, warning_percentage=15):
+    if not any(stats_df[f'{col}_count'].sum() > 0 for col in metric_columns):
+        return None
+    fig_name = get_fig_name(filters.get('microscope'), filters.get('objective'), filters.get('test'))
+    fig, change_df, warning = fig_data_from_stats(stats_df, fig_name, filters.get('test'), consider_limit, warning_percentage)
+    return fig, change_df, fig_name, warning
+
+
+# Per-group statistics for every group of `by` at once (e.g. every
+# microscope/objective pair for generate_html.py): the records -- or, with
+# from_stats=True, the statistics cube rows -- are aggregated in a single
+# grouped pass, and each group's slice comes with a render function, so
+# callers can skip unchanged groups or render in another process (render is
+# a functools.partial and pickles with its slice).
+# Yield: group key (tuple), group statistics, render(consider_limit, warning_percentage)
+# returning render_group_fig_data's result
+def generate_group_fig_data(df, by=('microscope', 'objective'), from_stats=False):
+    by = list(by)
+    all_stats = group_stats(df, by, from_stats=from_stats)
+    for key, stats_df in all_stats.groupby(by, sort=True):
+        key = key if isinstance(key, tuple) else (key,)
+        yield key, stats_df, partial(render_group_fig_data, stats_df, dict(zip(by, key)))
+
+
+# Fleet-wide drift overview: the generate_fig_data deviation check (last date
+# against the mean of up to consider_limit previous dates, flagged when any
+# metric moves more than warning_percentage) for every group of `by` at once.
+# Per-date means come from one group_stats pass, the dates of each group are
+# ranked newest first, and the last date and the baseline dates are then
+# selected and averaged with vectorised groupby operations -- no per-group
+# Python loop, so hundreds of groups and years of history stay fast.
+# Return: one row per group (sorted: warnings first, then largest change)
+# with the `by` columns, last_date, dates, "<metric> (%)" changes,
+# "max_abs_change (%)", warning and status
+def drift_overview(df, by=index_columns, consider_limit=3, warning_percentage=15, from_stats=False):
+    by = list(by)
+    stats_df = group_stats(df, by, from_stats=from_stats)
+    means = [f'{col}_mean' for col in metric_columns]
+    if stats_df.empty:
+        return pd.DataFrame(columns=by + ['last_date', 'dates', 'max_abs_change (%)', 'warning', 'status'])
+
+    stats_df = stats_df.sort_values(by + ['date'], ascending=[True] * len(by) + [False])
+    rank = stats_df.groupby(by, sort=False).cumcount()
+    last = stats_df[rank == 0].set_index(by)
+    baseline = stats_df[(rank >= 1) & (rank <= consider_limit)].groupby(by)[means].mean().reindex(last.index)
+    change = (last[means] - baseline) / baseline * 100
+    change.columns = [f'{col} (%)' for col in metric_columns]
+    change = change.loc[:, change.notna().any()]
+
+    result = pd.concat([last[['date']].rename(columns={'date': 'last_date'}), change], axis=1)
+    result.insert(1, 'dates', stats_df.groupby(by).size().reindex(last.index))
+    result['max_abs_change (%)'] = change.abs().max(axis=1)
+    result['warning'] = (change.abs() > warning_percentage).any(axis=1)
+    result['status'] = np.where(result['warning'], '🔴', '🟢')
+    result = result.reset_index().sort_values(
+        ['warning', 'max_abs_change (%)'], ascending=[False, False], na_position='last', kind='stable'
+    )
+    return result.reset_index(drop=True)
+
+
+# Deviation history: the deviation check of fig_data_from_stats for every
+# date instead of only the last one, to see when a drift started. Each date's
+# mean is compared with the mean of up to consider_limit dates before it (a
+# shifted rolling mean over the per-date rows of each group), for all metrics
+# and groups of `by` at once.
+# Return: dataframe with the `by` columns, date, metric, mean, baseline,
+# change (%) and warning, one row per measured metric and date (the first
+# date of a group has no baseline)
+def deviation_history(stats_df, by=(), consider_limit=3, warning_percentage=15):
+    by = list(by)
+    means = [f'{col}_mean' for col in metric_columns]
+    stats_df = stats_df.sort_values(by + ['date']).reset_index(drop=True)
+    if by:
+        shifted = stats_df.groupby(by, sort=False)[means].shift(1)
+        baseline = shifted.groupby([stats_df[col] for col in by], sort=False).rolling(consider_limit, min_periods=1).mean()
+        baseline = baseline.reset_index(level=list(range(len(by))), drop=True).sort_index()
+    else:
+        baseline = stats_df[means].shift(1).rolling(consider_limit, min_periods=1).mean()
+
+    history = pd.concat(
+        [
+            stats_df[by + ['date']].assign(metric=col, mean=stats_df[f'{col}_mean'], baseline=baseline[f'{col}_mean'])
+            for col in metric_columns
+        ],
+        ignore_index=True
+    )
+    history = history[history['mean'].notna()]
+    history['change (%)'] = (history['mean'] - history['baseline']) / history['baseline'] * 100
+    history['warning'] = history['change (%)'].abs() > warning_percentage
+    return history.sort_values(by + ['date'], kind='stable').reset_index(drop=True)
+
+
+# Figure of a deviation history: percentage change of every metric per date,
+# with the warning band
+# Return: figure
+def history_fig(history, fig_name, warning_percentage=15):
+    fig = px.line(
+        history,
+        x='date',
+        y='change (%)',
+        color='metric',
+        color_discrete_map=metric_colors,
+        labels={'change (%)': 'Change vs. previous dates (%)', 'date': 'Date', 'metric': 'Metric'},
+        hover_data={'mean': ':.4f', 'baseline': ':.4f'},
+        markers=True
+    )
+    fig.add_hrect(y0=-warning_percentage, y1=warning_percentage, fillcolor='green', opacity=0.08, line_width=0)
+    fig.update_layout(
+        title=dict(
+            text=f"Deviation history: {fig_name}",
+            x=0.5,  # Center align
+            xanchor='center'
         )
+    )
+    return fig
+
+
+# Generate deviation history figure and data for a query (see
+# generate_fig_data for the arguments)
+# Return: figure, history (None, None if there is no data)
+def generate_history_data(df, microscope=None, objective=None, test=None, bead_size=None, bead_number=None, start_date=None, end_date=None, consider_limit=3, warning_percentage=15, index=None, stats=None, stats_index=None):
+    try:
+        if stats is not None:
+            sdf = fetch_df(stats, microscope, objective, test, bead_size, bead_number, start_date, end_date, stats_index)
+        else:
+            sdf = fetch_df(df, microscope, objective, test, bead_size, bead_number, start_date, end_date, index)
+        if sdf.empty:
+            return None, None
+
+        stats_df = group_stats(sdf, from_stats=stats is not None)
+        history = deviation_history(stats_df, consider_limit=consider_limit, warning_percentage=warning_percentage)
+        fig_name = get_fig_name(microscope, objective, test, start_date, end_date)
+        return history_fig(history, fig_name, warning_percentage), history
+    except Exception:
+        logger.exception(
+            "generate_history_data failed (microscope=%s, objective=%s, test=%s, "
+            "bead_size=%s, bead_number=%s); returning no data.",
+            microscope, objective, test, bead_size, bead_number
+        )
+        return None, None
+
+
+# Generate figure, considered value and warning
+# With a statistics cube (stats, optionally indexed by stats_index) the
+# per-date statistics are combined from it instead of aggregating the raw
+# rows; df is then only used for the returned data and may be None.
+# Return: figure, data, change, title, warning
+def generate_fig_data(df, microscope=None, objective=None, test=None, bead_size=None, bead_number=None, start_date=None, end_date=None, consider_limit=3, warning_percentage=15, index=None, stats=None, stats_index=None):
+    try:
+        # fetch dataframe (only needed for the returned rows when a stats cube is given)
+        if stats is not None:
+            sdf = fetch_df(stats, microscope, objective, test, bead_size, bead_number, start_date, end_date, stats_index)
+            if sdf.empty:
+                return None, None, None, None, None
+            fdf = fetch_df(df, microscope, objective, test, bead_size, bead_number, start_date, end_date, index) if df is not None else None
+        else:
+            fdf = fetch_df(df, microscope, objective, test, bead_size, bead_number, start_date, end_date, index)
+            if fdf.empty:
+                return None, None, None, None, None
+
+        # get mean and deviation
+        stats_df = group_stats(sdf if stats is not None else fdf, from_stats=stats is not None)
+
+        fig_name = get_fig_name(microscope, objective, test, start_date, end_date)
+        fig, change_df, warning = fig_data_from_stats(stats_df, fig_name, test, consider_limit, warning_percentage)
 
         return fig, fdf, change_df, fig_name, warning
     except Exception:
@@ -151,16 +448,271 @@ def generate_fig_data(df, microscope=None, objective=None, test=None, bead_size=
             microscope, objective, test, bead_size, bead_number
         )
         return None, None, None, None, None
-    
+
+# Operators of the DataTable filter query language, in matching order
+# (two-character symbols before their one-character prefixes)
+filter_operators = [
+    ['ge ', '>='], ['le ', '<='], ['lt ', '<'], ['gt ', '>'], ['ne ', '!='], ['eq ', '='],
+    ['contains '], ['datestartswith ']
+]
+
+
+# Parse one "{column} operator value" part of a DataTable filter query
+# Return: column, operator, value (None, None, None if not understood)
+def split_filter_part(filter_part):
+    for operator_type in filter_operators:
+        for operator in operator_type:
+            if operator in filter_part:
+                name_part, value_part = filter_part.split(operator, 1)
+                name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+                value_part = value_part.strip()
+                if not value_part:
+                    return None, None, None
+                v0 = value_part[0]
+                if v0 == value_part[-1] and v0 in ("'", '"', '`'):
+                    value = value_part[1: -1].replace('\\' + v0, v0)
+                else:
+                    try:
+                        value = float(value_part)
+                    except ValueError:
+                        value = value_part
+                return name, operator_type[0].strip(), value
+    return None, None, None
+
+
+# Filter, sort and page a dataframe for a DataTable with custom
+# (server-side) paging, sorting and filtering; only the requested page is
+# converted to records. Filter parts that do not apply are ignored.
+# Return: page records, page count
+def table_page(df, page_current, page_size, sort_by=None, filter_query=None):
+    for filter_part in (filter_query or '').split(' && '):
+        col_name, operator, value = split_filter_part(filter_part)
+        if col_name not in df.columns:
+            continue
+        try:
+            if operator in ('eq', 'ne', 'lt', 'le', 'gt', 'ge'):
+                df = df.loc[getattr(df[col_name], operator)(value)]
+            elif operator == 'contains':
+                df = df.loc[df[col_name].astype(str).str.contains(str(value), regex=False)]
+            elif operator == 'datestartswith':
+                df = df.loc[df[col_name].astype(str).str.startswith(str(value))]
+        except Exception:
+            logger.debug("Ignoring table filter %r", filter_part)
+
+    sort_by = [col for col in (sort_by or []) if col['column_id'] in df.columns]
+    if sort_by:
+        df = df.sort_values(
+            [col['column_id'] for col in sort_by],
+            ascending=[col['direction'] == 'asc' for col in sort_by],
+            kind='stable'
+        )
+
+    page_current = page_current or 0
+    page_size = page_size or 25
+    page_count = max(1, -(-len(df) // page_size))
+    page_df = df.iloc[page_current * page_size:(page_current + 1) * page_size]
+    return page_df.to_dict('records'), page_count
+
+
+# Bounded LRU cache of generate_fig_data results
+# Several people tend to look at the same combinations, and every Submit
+# otherwise recomputes the groupby, deviation table and figure from scratch.
+# Only the figure, deviation table, name and warning are kept, not the
+# filtered records (callers fetch those through their RecordsIndex), so an
+# entry's size depends on the number of dates, not of records.
+# Entries are keyed by the normalised query and belong to one dataset
+# version: asking with a different version (the records changed) empties the
+# cache first. Cached results are shared, so callers must not modify them.
+class FigDataCache:
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def clear(self, version=None):
+        with self._lock:
+            self._entries.clear()
+            self.version = version
+
+    def generate_fig_data(self, version, df, microscope=None, objective=None, test=None, bead_size=None, bead_number=None, start_date=None, end_date=None, consider_limit=3, warning_percentage=15, index=None, stats=None, stats_index=None):
+        """generate_fig_data(...) for dataset `version` without the records: (figure, change, title, warning), served from the cache when possible"""
+        date_range = _date_range(start_date, end_date)
+        if date_range is None:
+            start_date = end_date = None
+        key = (microscope, objective, test, bead_size, bead_number, start_date, end_date, consider_limit, warning_percentage)
+
+        with self._lock:
+            if version != self.version:
+                if self._entries:
+                    logger.info("Records changed; dropping %d cached figure(s).", len(self._entries))
+                self._entries.clear()
+                self.version = version
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                logger.info("Figure cache hit (hits=%d, misses=%d).", self.hits, self.misses)
+                return result
+
+        # With a statistics cube the records are not needed at all
+        fig, _, change_df, fig_name, warning = generate_fig_data(
+            df if stats is None else None, microscope, objective, test, bead_size, bead_number, start_date, end_date,
+            consider_limit, warning_percentage, index, stats, stats_index
+        )
+        result = (fig, change_df, fig_name, warning)
+
+        with self._lock:
+            self.misses += 1
+            logger.info("Figure cache miss (hits=%d, misses=%d).", self.hits, self.misses)
+            if version == self.version:
+                self._entries[key] = result
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return result
+
+
+# Image files per data directory, as recorded by process_data.py
+# Looking images up here replaces a directory listing on the share per row
+# and per Submit. With revalidate=True a directory is stat'ed on lookup and
+# listed again only if its mtime changed since it was indexed. Directories
+# that are not in the index (e.g. newer than the last extraction) are listed
+# once and remembered.
+class ImageIndex:
+    def __init__(self, dirs=None, revalidate=False):
+        self.dirs = dict(dirs or {})
+        self.revalidate = revalidate
+        self._lock = threading.Lock()
+
+    def images(self, directory):
+        """Sorted .jpg file names in directory"""
+        entry = self.dirs.get(directory)
+        if entry is not None and not self.revalidate:
+            return entry["images"]
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            return entry["images"] if entry is not None else []
+        if entry is not None and entry["mtime"] == mtime:
+            return entry["images"]
+
+        images = sorted(os.path.basename(path) for path in glob.glob(os.path.join(directory, "*.jpg")))
+        with self._lock:
+            self.dirs[directory] = {"mtime": mtime, "images": images}
+        return images
+
+
+# Downscaled copy of a bead image in a local thumbnail cache
+# The thumbnail file name is derived from the source path, its mtime and
+# the size, so a changed source gets a new thumbnail. Thumbnails are written
+# through a temp file + rename so concurrent requests never serve a partial
+# file. A served thumbnail's mtime is refreshed (at most once an hour), so
+# with max_bytes the cache is pruned by least recent use (prune_thumbnails,
+# every _thumbnail_prune_every new thumbnails); old versions of changed
+# images are the first to go.
+# Return: path of the thumbnail, or None if it cannot be made (no Pillow,
+# unreadable image), in which case the caller serves the original
+_thumbnail_prune_every = 100
+_thumbnail_touch_age = 3600
+_thumbnails_made = 0
+_thumbnails_lock = threading.Lock()
+
+
+def get_thumbnail(image_path, cache_dir, size=400, max_bytes=None):
+    global _thumbnails_made
+    try:
+        from PIL import Image
+
+        mtime = os.stat(image_path).st_mtime_ns
+        key = hashlib.sha1(f"{image_path}|{mtime}|{size}".encode()).hexdigest()
+        thumb_path = os.path.join(cache_dir, f"{key}.jpg")
+        try:
+            if os.stat(thumb_path).st_mtime < time.time() - _thumbnail_touch_age:
+                os.utime(thumb_path)
+            return thumb_path
+        except FileNotFoundError:
+            pass
+
+        os.makedirs(cache_dir, exist_ok=True)
+        with Image.open(image_path) as img:
+            img.thumbnail((size, size))
+            if img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            tmp_path = f"{thumb_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            img.save(tmp_path, format="JPEG", quality=85)
+        os.replace(tmp_path, thumb_path)
+
+        if max_bytes is not None:
+            with _thumbnails_lock:
+                _thumbnails_made += 1
+                prune = _thumbnails_made % _thumbnail_prune_every == 0
+            if prune:
+                prune_thumbnails(cache_dir, max_bytes)
+        return thumb_path
+    except ImportError:
+        return None
+    except Exception:
+        logger.warning("Could not make a thumbnail of %s; serving the original.", image_path, exc_info=True)
+        return None
+
+
+# Shrink the thumbnail cache to at most max_bytes
+# Deletes the least recently used thumbnails (oldest mtime) until the rest
+# fit in 90% of max_bytes, so the next prune is not due right away, and temp
+# files left behind by interrupted writes.
+# Return: number of deleted files
+def prune_thumbnails(cache_dir, max_bytes):
+    try:
+        entries = list(os.scandir(cache_dir))
+    except FileNotFoundError:
+        return 0
+    removed = 0
+    thumbnails = []
+    for entry in entries:
+        try:
+            st = entry.stat()
+        except OSError:
+            continue
+        if entry.name.endswith(".tmp"):
+            if st.st_mtime < time.time() - _thumbnail_touch_age:
+                try:
+                    os.remove(entry.path)
+                    removed += 1
+                except OSError:
+                    pass
+        elif entry.name.endswith(".jpg"):
+            thumbnails.append((st.st_mtime, st.st_size, entry.path))
+
+    total = sum(size for _, size, _ in thumbnails)
+    if total > max_bytes:
+        thumbnails.sort()
+        for _, size, path in thumbnails:
+            if total <= max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+            total -= size
+        logger.info("Pruned the thumbnail cache %s to %.1f MB.", cache_dir, total / 1e6)
+    return removed
+
+
 # Get the list of image relative paths
+# Uses image_index (an ImageIndex) when given instead of listing the directory
 # Return: list
-def get_image_paths(input_path, base_path = "/mcs_bead_project/data/"):
+def get_image_paths(input_path, base_path = "/mcs_bead_project/data/", image_index=None):
     # Extract the directory from the input path
     directory = os.path.dirname(input_path)
-    
-    # Use glob to find all .jpg files in the directory
-    image_files = glob.glob(os.path.join(directory, "*.jpg"))
+
+    if image_index is not None:
+        image_files = [os.path.join(directory, name) for name in image_index.images(directory)]
+    else:
+        # Use glob to find all .jpg files in the directory
+        image_files = glob.glob(os.path.join(directory, "*.jpg"))
     relative_paths = [path.replace(base_path, "") for path in image_files]
     
     return relative_paths
-    
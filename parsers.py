@@ -0,0 +1,208 @@
+import os
+import re
+import mmap
+import time
+import logging
+import argparse
+import tempfile
+
+from records_store import metric_columns
+
+# Parsers for the result files (.xls text exports) of each test type.
+#
+# Every test type is described by a TestParser: the test tokens it handles
+# (exact names such as "PSFo", or prefixes such as "CenHom" for
+# "CenHomFITC488Sona"), the metric columns its values go to and a function
+# that finds the values in the file content. The content is memory-mapped and
+# searched as bytes with the precompiled patterns below, so a file is neither
+# decoded nor split into lines, and the search stops at the first section
+# that holds the values. parser_for() picks the parser for a test token;
+# tests without a registered parser are read as three-channel chromatic
+# tests, except the known tests whose result layout is not supported yet
+# (unsupported_prefixes), which have no parser unless the file is named like a
+# bead test. Legacy test names are normalized first (normalize_test).
+#
+# Use: python3 parsers.py [-n <repeats>] [--padding <lines>]
+#      (micro-benchmark: parse time per file for each test type)
+
+logger = logging.getLogger("parsers")
+
+_psfo_token = b"Measured FWHM"
+_psfo_axis = re.compile(rb"(X|Y|Z)\t([\d.]+)")
+_calibrated_token = b"calibrated distances"
+_chunk_size = 1 << 16
+_channel_line = re.compile(rb"^Channel 1[^\r\n]*", re.MULTILINE)
+_value_with_error = re.compile(rb"\b\d+\.\d+\b(?=\s*\()")
+_value = re.compile(rb"\b\d+\.\d+\b")
+
+
+def normalize_test(test):
+    """Canonical name of a test token: legacy Hom... tokens become CenHom... (FITC slide if none is given)"""
+    if test.startswith("Hom"):
+        rest = test[3:]
+        if rest[:1].isdigit():
+            rest = "FITC" + rest
+        return "CenHom" + rest
+    return test
+
+
+def _line_end(data, pos):
+    end = data.find(b"\n", pos)
+    return len(data) if end < 0 else end
+
+
+def parse_psfo(data):
+    """FWHM values (x, y, z) from a PSF result, either on the 'Measured FWHM' line or on the X/Y/Z lines below it"""
+    pos = data.find(_psfo_token)
+    if pos < 0:
+        return None
+    start = data.rfind(b"\n", 0, pos) + 1
+    end = _line_end(data, pos)
+    line = data[start:end].strip()
+    if line.startswith(_psfo_token):
+        return [float(value) for value in line.split(b"\t")[1:]]
+
+    values = []
+    for _ in range(3):
+        if end >= len(data):
+            break
+        start = end + 1
+        end = _line_end(data, start)
+        match = _psfo_axis.search(data, start, end)
+        if match:
+            values.append(float(match.group(2)))
+    return values
+
+
+def _calibrated_section(data):
+    """Position of the first 'Calibrated distances' header (any case, not 'Uncalibrated'), or -1"""
+    # Lower-cased a bounded chunk at a time (plus the two bytes before it, for
+    # the "un" check): a plain substring search is several times faster than
+    # a case-insensitive pattern.
+    pos = 0
+    while pos < len(data):
+        base = max(0, pos - 2)
+        chunk = data[base:pos + _chunk_size + len(_calibrated_token)].lower()
+        found = chunk.find(_calibrated_token, pos - base)
+        while found >= 0:
+            if chunk[max(0, found - 2):found] != b"un":
+                return base + found
+            found = chunk.find(_calibrated_token, found + 1)
+        pos += _chunk_size
+    return -1
+
+
+def parse_channels(data):
+    """Values on the first 'Channel 1' line after the 'Calibrated distances' header"""
+    pos = _calibrated_section(data)
+    if pos < 0:
+        return None
+    match = _channel_line.search(data, _line_end(data, pos) + 1)
+    if match is None:
+        return None
+    line = match.group()
+    values = _value_with_error.findall(line) or _value.findall(line)
+    return [float(value) for value in values]
+
+
+class TestParser:
+    def __init__(self, name, parse, columns, tokens=(), prefixes=()):
+        self.name = name
+        self.parse_data = parse
+        self.columns = columns
+        self.tokens = tuple(tokens)
+        self.prefixes = tuple(prefixes)
+
+    def matches(self, test):
+        return test in self.tokens or test.startswith(self.prefixes)
+
+    def parse(self, path):
+        """Values found in the file at path, or None if it has none or cannot be read"""
+        try:
+            with open(path, "rb") as fh:
+                if os.fstat(fh.fileno()).st_size == 0:
+                    return None
+                with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    return self.parse_data(data)
+        except Exception as e:
+            logger.debug("%s parser failed for %s: %s", self.name, path, e)
+            return None
+
+    def metrics(self, path):
+        """Values of all metric columns for the file at path ("NA" where this test has none), or None without target data"""
+        values = self.parse(path)
+        if values is None or len(values) != len(self.columns):
+            return None
+        found = dict(zip(self.columns, values))
+        return [found.get(col, "NA") for col in metric_columns]
+
+
+parsers = []
+
+
+def register(parser):
+    """Add a parser to the registry; the first registered parser matching a test is used"""
+    parsers.append(parser)
+    return parser
+
+
+register(TestParser("PSFo", parse_psfo, ["x", "y", "z"], tokens=["PSFo"]))
+register(TestParser("ChromDual", parse_channels, ["dual"], tokens=["ChromDual"]))
+
+# Centricity / homogeneity results (naming_cases.md): the file layout and the
+# metrics it holds are not specified yet, so there is no parser and such
+# files are listed as unprocessed instead of being read as something else.
+# Older (T)Hom results named like bead tests (with _S/_B tokens) have always
+# been read as three-channel chromatic tests and still are, until a CenHom
+# parser exists, so records.csv keeps their rows.
+unsupported_prefixes = ("CenHom",)
+
+# Any other test (e.g. ChromTri)
+default_parser = TestParser("Chrom", parse_channels, ["far_red", "red", "uv"])
+
+
+def parser_for(test, bead_tokens=True):
+    """Parser for a (normalized) test token, or None for a test that cannot be parsed yet.
+
+    bead_tokens: whether the file name carries the _S/_B tokens of a bead test.
+    """
+    for parser in parsers:
+        if parser.matches(test):
+            return parser
+    if test.startswith(unsupported_prefixes) and not bead_tokens:
+        return None
+    return default_parser
+
+
+# Sample results for the benchmark, one per parser
+_samples = {
+    "PSFo": "Bead\t1\nMeasured FWHM\t0.213\t0.208\t0.611\n",
+    "ChromDual": "Uncalibrated distances\nChannel 1\t0.101 (0.02)\nCalibrated distances\nChannel 1\t0.093 (0.02)\n",
+    "Chrom": "Calibrated distances\nChannel 1\t0.051 (0.01)\t0.047 (0.01)\t0.062 (0.01)\n",
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the parse time per result file for each test type.")
+    parser.add_argument('-n', '--repeats', type=int, default=2000, help="Parses per test type (optional, default: 2000).")
+    parser.add_argument('--padding', type=int, default=200,
+                        help="Filler lines before the values in each sample file (optional, default: 200).")
+    args = parser.parse_args()
+
+    filler = "".join(f"Row {i}\t{i * 0.5:.1f}\t{i * 0.25:.2f}\n" for i in range(args.padding))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for test_parser in parsers + [default_parser]:
+            path = f"{tmp_dir}/{test_parser.name}.xls"
+            with open(path, "w") as fh:
+                fh.write(filler + _samples[test_parser.name])
+            if test_parser.metrics(path) is None:
+                parser.exit(1, f"{test_parser.name}: no values found in the sample file\n")
+            start = time.perf_counter()
+            for _ in range(args.repeats):
+                test_parser.metrics(path)
+            elapsed = time.perf_counter() - start
+            print(f"{test_parser.name:<10} {elapsed / args.repeats * 1e6:8.1f} us/file  ({os.path.getsize(path)} bytes)")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,23 @@
 import os
 import csv
-import glob
 import re
-import shutil
-import hashlib
+import json
 import logging
 import argparse
-from datetime import datetime
+import time
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
+from backup import backup_records, prune_backups
 from log_config import configure_logging
+from parsers import normalize_test, parser_for
+from records_store import (
+    append_changelog, append_image_index, append_journal, append_stats_cube, apply_journal, dataset_version,
+    file_version, image_index_path, journal_path, load_image_index, load_records, read_changelog, read_journal,
+    read_stamp, records_frame, records_paths, records_version, read_records_csv, remove_journal, reset_changelog,
+    stats_key_columns, stats_path, write_image_index, write_records_parquet, write_stats_cube
+)
 
 # Functions for differnet operations
 def get_meta_values(input_str):
@@ -26,264 +35,640 @@ def get_meta_values(input_str):
         logging.getLogger("process_data").debug("get_meta_values failed for %r: %s", input_str, e)
         return None
 
-def extract_values_psfo(file_path):
-    """Get property values from type psfo"""
-    try:
-        if not os.path.exists(file_path):
-            return None
 
-        # Handle two types of patterns and fetch the values 
-        values_line = None
-        values_lines = []
-        capture = False
-        with open(file_path, 'r') as file:
-            for line in file:
-                if capture:
-                    values_lines.append(line.strip())
-                    if len(values_lines) == 3:
-                        break
-                if "Measured FWHM" in line:
-                    values_line = line.strip()
-                    if values_line.startswith('Measured FWHM'):
-                        break
-                    else:
-                        capture = True
-                        continue
-
-        if values_line is None:
-            return None
+logger = logging.getLogger("process_data")
 
-        if not values_lines:
-            values = (values_line.split('\t'))[1:] 
-            values = [float(value) for value in values]
-        else:
-            values = [
-                float(re.search(r'(X|Y|Z)\t([\d.]+)', line).group(2))
-                for line in values_lines
-                if re.search(r'(X|Y|Z)\t([\d.]+)', line)
-            ]
-        
-        return values
+# CSV header
+csv_header = ["date","microscope","objective","test","bead_size","bead_number","far_red","red","uv","dual","x","y","z","file_path"]
 
-    except Exception as e:
-        logging.getLogger("process_data").debug("extract_values_psfo failed for %s: %s", file_path, e)
-        return None
+# Input files must carry the naming scheme somewhere in their path (bead tests
+# with _S/_B tokens; centricity/homogeneity tests without, see naming_cases.md)
+pattern = re.compile(r".*\d{8}_M.*_O.*_T.*_S.*_B.*|.*\d{8}_M.*_O.*_T(?:Cen)?Hom")
 
-def extract_values_chrom(file_path):
-    """Get property values from the types of chrom"""
+# Extract values from valid files and store to records.csv
+data_pattern = re.compile(r"\d{8}_M[^_]*_O[^_]*_T[^_]*_S[^_]*_B\d+|\d{8}_M[^_]*_O[^_]*_T(?:Cen)?Hom[^_/.]*")
+
+def extract_row(path):
+    """Parse one valid file; returns ("record", full records.csv row), ("dataless", None) without target
+    data or ("unprocessed", None) for a test that has no parser yet"""
+    matches = data_pattern.findall(path)
+    row = []
+    if matches:
+        value = matches[-1]
+        meta_values = get_meta_values(value)
+        if isinstance(meta_values, list) and len(meta_values) == 6:
+            meta_values[3] = normalize_test(meta_values[3])
+            parser = parser_for(meta_values[3], bead_tokens="_S" in value)
+            if parser is None:
+                return "unprocessed", None
+            row.extend(meta_values)
+            properties = parser.metrics(path)
+            if properties is not None:
+                row.extend(properties + [rf"{path}"])
+
+    if isinstance(row, list) and len(row) == len(csv_header):
+        return "record", row
+    return "dataless", None
+
+# Parse manifest: remembers, per .xls path, the size/mtime it had when last
+# parsed and what came out of it (a records.csv row, "dataless" or
+# "unprocessed"). Files whose size and mtime are unchanged are not opened
+# again, which is what made restarts slow on the network share: only new or
+# modified files are parsed, deleted ones simply drop out, and the output
+# files are updated from the changes to the manifest. MANIFEST_VERSION must be bumped
+# whenever the parsers or the row layout change so old entries are discarded.
+MANIFEST_VERSION = 4
+
+# The manifest and the scan cache are JSON snapshots (manifest.json,
+# scan_cache.json) plus a journal of the entries changed since (manifest.log,
+# scan_cache.log; {"key", "value"} lines, value null for a removed entry, in
+# the journal format of records_store). A run that changes a few files
+# appends a few lines instead of rewriting the whole state; the snapshot is
+# rewritten once the journal grows past compact_rows entries, or (the
+# manifest) together with records.csv.
+
+def load_json_state(path, version, description, key):
+    """Load a JSON state file written by write_json_state with its journal applied to state[key].
+
+    state["journal"] is the number of journal entries applied. Returns None if
+    the state is missing, unreadable or outdated.
+    """
     try:
-        if not os.path.exists(file_path):
-            return None
-
-        target_line = None
-        target_section = None
-        with open(file_path, 'r') as file:
-            for line in file:
-                # Check if we are in the "Calibrated distances" section
-                if ("calibrated distances" in line.lower() and "uncalibrated distances" not in line.lower()):
-                    target_section = True
-                    continue
-                    
-                if target_section and line.startswith("Channel 1"):
-                    target_line = line.strip()  # Remove any leading/trailing whitespace
-                    break
-
-        if target_line is None:
+        with open(path) as fh:
+            state = json.load(fh)
+        if state.get("version") != version or state.get("header") != csv_header:
+            logger.info("%s %s is outdated; starting from scratch.", description, path)
             return None
-                    
-        values = re.findall(r"\b\d+\.\d+\b(?=\s*\()", target_line)
-        if not values:
-            values = re.findall(r"\b\d+\.\d+\b", target_line)
-        values = [float(value) for value in values]
-        return values
+        entries = read_journal(journal_path(path), file_version(path))
+        apply_journal(state[key], entries)
+        state["journal"] = len(entries)
+        return state
+    except FileNotFoundError:
+        return None
     except Exception as e:
-        logging.getLogger("process_data").debug("extract_values_chrom failed for %s: %s", file_path, e)
+        logger.warning("Could not read %s %s (starting from scratch): %s", description, path, e)
         return None
 
+def write_json_state(path, version, description, **content):
+    """Write a JSON state snapshot through a temp file + rename so a crash never leaves it half-written.
 
-# Setup arguments for the python file
-# Use: python3 process_data.py -d </path/to/dir> -b <backup_limit>
-parser = argparse.ArgumentParser(description="Process a directory path.")
-parser.add_argument('-d', '--directory', type=str, default=".", help="Path to the directory (optional).")
-parser.add_argument('-b', '--backup', type=int, default=100, help="Backup number (optional, default: 100).")
-parser.add_argument('-e', '--excel-max-rows', type=int, default=100000,
-                    help="Max record rows to still generate records.xlsx; above this it is skipped (optional, default: 100000). Set 0 to disable Excel.")
-args = parser.parse_args()
-root_dir = args.directory
-backup_limit = args.backup
-excel_max_rows = args.excel_max_rows
-
-# Setup required paths
-data_dir = f"{root_dir}/data"
-fetch_dir = f"{root_dir}/extracted"
-backup_dir = f"{root_dir}/backup"
-html_dir = f"{fetch_dir}/html"
-csv_file = f"{fetch_dir}/records.csv"
-excel_file = f"{fetch_dir}/records.xlsx"
-unprocessed_file = f"{fetch_dir}/unprocessed.txt"
-dataless_file = f"{fetch_dir}/dataless.txt"
-
-# Create required directories
-os.makedirs(fetch_dir, exist_ok=True)
-os.makedirs(backup_dir, exist_ok=True)
-os.makedirs(html_dir, exist_ok=True)
-
-# Configure logging (stdout, captured per-container by `docker logs`)
-configure_logging()
-logger = logging.getLogger("process_data")
-logger.info("Starting data processing (directory=%s, backup_limit=%s)", root_dir, backup_limit)
-
-# Back up the PREVIOUS run's records before records.csv is overwritten below.
-#
-# Only records.csv is irreplaceable; figures.html, the html/ tree and
-# records.xlsx are all regenerable from it, so we don't copy them -- this is a
-# big disk + time saving on the shared network volume (one small file instead of
-# walking a large many-file tree over SMB). The two tiny .txt reports are bundled
-# along. We also skip making a snapshot when records.csv is unchanged since the
-# last backup, so plain restarts don't pile up duplicate backups.
-
-def file_hash(path):
-    """Content hash of a file, or None if it can't be read."""
+    Its journal is removed afterwards; until then it no longer matches the
+    new snapshot and is ignored.
+    """
+    tmp_path = f"{path}.tmp"
     try:
-        h = hashlib.md5()
-        with open(path, "rb") as fh:
-            for chunk in iter(lambda: fh.read(65536), b""):
-                h.update(chunk)
-        return h.hexdigest()
-    except Exception:
-        return None
+        with open(tmp_path, "w") as fh:
+            json.dump({"version": version, "header": csv_header, **content}, fh)
+        os.replace(tmp_path, path)
+        remove_journal(journal_path(path))
+    except Exception as e:
+        logger.warning("Could not write %s %s (next run starts from scratch): %s", description, path, e)
 
-# Existing backups, oldest first
-b_dir = [d for d in glob.glob(f"{backup_dir}/*") if os.path.isdir(d)]
-b_dir.sort(key=os.path.getctime)
-
-# Snapshot only if the current (previous-run) records.csv differs from the latest backup
-current_hash = file_hash(csv_file) if os.path.exists(csv_file) else None
-latest_backup_hash = file_hash(f"{b_dir[-1]}/records.csv") if b_dir else None
-
-if current_hash is None:
-    logger.info("No existing records.csv to back up; skipping backup.")
-elif current_hash == latest_backup_hash:
-    logger.info("records.csv unchanged since last backup; skipping backup.")
-else:
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    ctime = datetime.now().timestamp()
-    current_b_dir = f"{backup_dir}/{timestamp}"
-    os.makedirs(current_b_dir, exist_ok=True)
+def append_json_state(path, description, changes):
+    """Append {key: value or None} changes to the journal of the JSON state snapshot at path"""
     try:
-        for src in (csv_file, unprocessed_file, dataless_file):
-            if os.path.exists(src):
-                shutil.copy2(src, current_b_dir)
-        os.utime(current_b_dir, (ctime, ctime))
-        b_dir.append(current_b_dir)  # newest -> keep at end for correct pruning
-        logger.info("Backed up records.csv to %s", current_b_dir)
+        entries = [{"key": key, "value": value} for key, value in changes.items()]
+        append_journal(journal_path(path), file_version(path), entries)
     except Exception as e:
-        logger.warning("Could not back up records to %s: %s", current_b_dir, e)
+        logger.warning("Could not append to %s %s (next run works from an older state): %s", description, path, e)
+
+def state_changes(previous, current):
+    """{key: value} for every entry added or changed from previous to current, {key: None} for every entry removed"""
+    changes = {key: value for key, value in current.items() if previous.get(key) != value}
+    changes.update((key, None) for key in previous if key not in current)
+    return changes
+
+def save_json_state(path, version, description, key, previous_state, current, journal_limit, rewrite=False, **content):
+    """Persist current (the new state[key]): append its changes to the journal, or rewrite the snapshot.
+
+    The snapshot is rewritten when there is no usable previous state, when
+    rewrite is set or when the journal would grow past journal_limit entries.
+    content are the other snapshot fields (they are only stored on a rewrite).
+    """
+    if previous_state is not None and not rewrite:
+        changes = state_changes(previous_state[key], current)
+        if not changes:
+            return
+        if previous_state["journal"] + len(changes) <= journal_limit:
+            append_json_state(path, description, changes)
+            return
+    write_json_state(path, version, description, **{key: current}, **content)
+
+# Scan cache: the modification time and the .xls/.jpg/subdirectory names of
+# every directory under data/ as seen by the last scan. A directory's mtime only
+# changes when entries are added, removed or renamed in it, so a directory
+# whose mtime is unchanged is not listed again and the files in it are not
+# stat'ed again either -- their manifest entries are reused as they are. Each
+# directory still costs one stat, but the year-old folders that make up most
+# of the archive are no longer re-listed over SMB on every run. Files edited
+# in place (same name) do not change their directory's mtime, so a run still
+# stats every listed file (stat_files) and re-parses those whose size or
+# mtime changed. Only the passes of --watch skip those stats, and every
+# --full-scan-every passes they list and stat everything again.
+SCAN_CACHE_VERSION = 2
+
+def scan_data_dir(dir_path, previous_scan_cache, new_scan_cache):
+    """Walk dir_path with os.scandir and yield (path, valid, unchanged) for each .xls file.
+
+    Files come in sorted order (files of a directory first, then its
+    subdirectories), so the output does not depend on the file system's
+    listing order. Hidden files and directories are skipped, as glob would.
+    Each visited directory is recorded in new_scan_cache.
+    """
+    try:
+        mtime = os.stat(dir_path).st_mtime_ns
+    except OSError as e:
+        logger.warning("Could not read directory %s (skipping): %s", dir_path, e)
+        return
+
+    cached = previous_scan_cache.get(dir_path)
+    unchanged = cached is not None and cached["mtime"] == mtime
+    if unchanged:
+        files, images, dirs = cached["files"], cached["images"], cached["dirs"]
+    else:
+        files, images, dirs = [], [], []
+        try:
+            with os.scandir(dir_path) as it:
+                for entry in it:
+                    if entry.name.startswith("."):
+                        continue
+                    try:
+                        if entry.is_dir():
+                            dirs.append(entry.name)
+                        elif entry.name.endswith(".xls"):
+                            files.append(entry.name)
+                        elif entry.name.endswith(".jpg"):
+                            images.append(entry.name)
+                    except OSError as e:
+                        logger.debug("Could not inspect %s: %s", entry.path, e)
+        except OSError as e:
+            logger.warning("Could not list directory %s (skipping): %s", dir_path, e)
+            return
+        files.sort()
+        images.sort()
+        dirs.sort()
+    new_scan_cache[dir_path] = {"mtime": mtime, "files": files, "images": images, "dirs": dirs}
+
+    for name in files:
+        path = os.path.join(dir_path, name)
+        yield path, bool(pattern.match(path)), unchanged
+    for name in dirs:
+        yield from scan_data_dir(os.path.join(dir_path, name), previous_scan_cache, new_scan_cache)
+
+def process_file(item, previous_manifest, settle_before=None):
+    """Parse one scanned .xls file if it is new or changed; returns (path, manifest entry, parsed).
+
+    With settle_before (ns timestamp), a new or changed file modified after
+    it is not parsed yet: its entry has status "settling".
+    """
+    path, valid, unchanged = item
+    entry = previous_manifest.get(path)
+    if unchanged and entry is not None:
+        return path, entry, False
 
-# Prune oldest backups beyond the limit
-if len(b_dir) > backup_limit:
-    for dir_to_delete in b_dir[:-backup_limit]:
+    try:
+        st = os.stat(path)
+        size, mtime = st.st_size, st.st_mtime_ns
+    except OSError as e:
+        logger.debug("Could not stat %s: %s", path, e)
+        size, mtime = None, None
+
+    if entry is not None and size is not None and entry.get("size") == size and entry.get("mtime") == mtime:
+        return path, entry, False
+
+    if settle_before is not None and mtime is not None and mtime > settle_before:
+        return path, {"status": "settling", "size": size, "mtime": mtime}, False
+    if not valid:
+        return path, {"status": "unprocessed", "size": size, "mtime": mtime}, False
+    status, row = extract_row(path)
+    entry = {"status": status, "row": row} if row is not None else {"status": status}
+    entry.update(size=size, mtime=mtime)
+    return path, entry, True
+
+def ordered_map(func, items, workers):
+    """Like map(), but runs func on a bounded thread pool; results keep the input order.
+
+    Only a window of workers * 4 tasks is in flight at once, so memory stays
+    flat however many files there are, and the output order (and therefore
+    records.csv) is identical for any number of workers.
+    """
+    if workers <= 1:
+        yield from map(func, items)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= workers * 4:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def record_changes(previous_manifest, manifest):
+    """(file_path, row) for every record added or changed since previous_manifest, (file_path, None) for every record removed"""
+    changes = []
+    for path, entry in manifest.items():
+        previous = previous_manifest.get(path)
+        if entry["status"] == "record" and (
+            previous is None or previous["status"] != "record" or previous["row"] != entry["row"]
+        ):
+            changes.append((path, entry["row"]))
+    for path, entry in previous_manifest.items():
+        if entry["status"] == "record" and manifest.get(path, {}).get("status") != "record":
+            changes.append((path, None))
+    return changes
+
+def report_status(entry):
+    """The report a manifest entry is listed in: "dataless", "unprocessed" or None for a record"""
+    if entry["status"] == "record":
+        return None
+    return "dataless" if entry["status"] == "dataless" else "unprocessed"
+
+def publish_reports(manifest, previous_manifest, reports, rewrite=False):
+    """Bring dataless.txt and unprocessed.txt ({status: path} in reports) up to date with the manifest.
+
+    Paths new to a report are appended to it; a report is only rewritten
+    (through a temp file + rename, in manifest order) when paths dropped out
+    of it, when it is missing or with rewrite (previous_manifest unknown).
+    """
+    for status, report_file in reports.items():
+        paths = [path for path, entry in manifest.items() if report_status(entry) == status]
+        previous = {path for path, entry in previous_manifest.items() if report_status(entry) == status}
+        current = set(paths)
+        if rewrite or not previous <= current or not os.path.exists(report_file):
+            with open(f"{report_file}.tmp", 'w') as fh:
+                fh.writelines(f"{path}\n" for path in paths)
+            os.replace(f"{report_file}.tmp", report_file)
+        elif current != previous:
+            with open(report_file, 'a') as fh:
+                fh.writelines(f"{path}\n" for path in paths if path not in previous)
+
+def stats_key(row):
+    """Statistics cube group of a records.csv row, compared as the cube compares it (bead size and number by value)"""
+    def value(text):
+        try:
+            number = float(text)
+        except ValueError:
+            return None if text in ("", "NA") else text
+        return number if number == number else None
+    date, microscope, objective, test, bead_size, bead_number = row[:6]
+    return microscope, objective, test, value(bead_size), value(bead_number), date
+
+def changed_stats_groups(previous_manifest, manifest, changes):
+    """(rows, key_rows) for the statistics cube groups touched by record changes: the records.csv rows now in
+    those groups, and the old and new rows of the changed records (which name the groups)"""
+    key_rows = [row for _, row in changes if row is not None]
+    key_rows += [
+        previous_manifest[path]["row"] for path, _ in changes
+        if previous_manifest.get(path, {}).get("status") == "record"
+    ]
+    keys = {stats_key(row) for row in key_rows}
+    rows = [entry["row"] for entry in manifest.values() if entry["status"] == "record" and stats_key(entry["row"]) in keys]
+    return rows, key_rows
+
+def image_index(manifest, scan_cache):
+    """Image index entries ({directory: {"mtime", "images"}}) of every directory holding a record"""
+    record_dirs = sorted({os.path.dirname(path) for path, entry in manifest.items() if entry["status"] == "record"})
+    return {
+        d: {"mtime": scan_cache[d]["mtime"], "images": scan_cache[d]["images"]}
+        for d in record_dirs if d in scan_cache
+    }
+
+def publish_records(manifest, csv_file):
+    """Write a new records.csv snapshot from the manifest through a temp file + rename.
+
+    Readers (the app reloads records.csv while it runs) only ever see a
+    complete file.
+    """
+    with open(f"{csv_file}.tmp", 'w', newline='') as csv_fh:
+        writer = csv.writer(csv_fh)
+        writer.writerow(csv_header)
+        for entry in manifest.values():
+            if entry["status"] == "record":
+                writer.writerow(entry["row"])
+    os.replace(f"{csv_file}.tmp", csv_file)
+
+def write_derived(fetch_dir, parquet=True, stats=True, stats_groups=None):
+    """Write the derived copies that app.py and generate_html.py load instead of
+    re-parsing and re-aggregating records.csv: the typed, partitioned Parquet
+    copy of the records.csv snapshot and the per-date statistics cube of the
+    records including the changelog. With stats_groups (see
+    changed_stats_groups), only those groups are recomputed and appended to
+    the cube's journal (stats.log). They
+    are regenerable, so a failure only means readers fall back to the CSV.
+    """
+    csv_file, parquet_dir = records_paths(fetch_dir)
+    stats_file = stats_path(fetch_dir)
+    if parquet:
         try:
-            shutil.rmtree(dir_to_delete)
+            records_stamp = records_version(csv_file)
+            records_df = read_records_csv(csv_file)
+            write_records_parquet(records_df, parquet_dir, records_stamp)
+            logger.info("Wrote %s (%d rows).", parquet_dir, len(records_df))
+            del records_df
         except Exception as e:
-            logger.warning("Could not remove old backup %s: %s", dir_to_delete, e)
-
-# CSV header
-csv_header = ["date","microscope","objective","test","bead_size","bead_number","far_red","red","uv","dual","x","y","z","file_path"]
-
-# Get xls files for processing
-xls_files = glob.glob(f"{data_dir}/**/*.xls", recursive=True)
-pattern = r".*\d{8}_M.*_O.*_T.*_S.*_B.*"
-valid_files = [f for f in xls_files if re.match(pattern, f)]
-untracked_files = [f for f in xls_files if not re.match(pattern, f)]
-logger.info(
-    "Found %d .xls files: %d match the naming scheme, %d untracked (see unprocessed.txt).",
-    len(xls_files), len(valid_files), len(untracked_files)
-)
-
-# Write the list of untracked files
-with open(unprocessed_file, "w") as f:
-    f.writelines(p + '\n' for p in untracked_files)
-
-# Extract values from valid files and store to records.csv
-data_pattern = r"\d{8}_M[^_]*_O[^_]*_T[^_]*_S[^_]*_B\d+"
-
-extracted_count = 0
-dataless_count = 0
-
-# Open records.csv and dataless.txt once for the whole loop instead of
-# reopening them per row. On a network share each open/close is a round-trip,
-# so per-row reopening dominated the cost as the dataset grew.
-with open(csv_file, 'w', newline='') as csv_fh, open(dataless_file, 'w') as dataless_fh:
-    writer = csv.writer(csv_fh)
-    writer.writerow(csv_header)
-
-    for path in valid_files:
-        matches = re.findall(data_pattern, path)
-        row = []
-        if matches:
-            value = matches[-1]
-            meta_values = get_meta_values(value)
-            if isinstance(meta_values, list) and len(meta_values) == 6:
-                row.extend(meta_values)
-                if meta_values[3] == "PSFo":
-                    properties = extract_values_psfo(path)
-                    if isinstance(properties, list) and len(properties) == 3:
-                        row.extend(["NA", "NA", "NA", "NA"] + properties + [rf"{path}"])
-                elif meta_values[3] == "ChromDual":
-                    properties = extract_values_chrom(path)
-                    if isinstance(properties, list) and len(properties) == 1:
-                        row.extend(["NA", "NA", "NA"] + properties + ["NA", "NA", "NA"] + [rf"{path}"])
-                else:
-                    properties = extract_values_chrom(path)
-                    if isinstance(properties, list) and len(properties) == 3:
-                        row.extend(properties + ["NA", "NA", "NA", "NA", rf"{path}"])
-
-        if isinstance(row, list) and len(row) == 14:
-            writer.writerow(row)
+            logger.warning("Could not write Parquet records %s (readers will use records.csv): %s", parquet_dir, e)
+    if stats and stats_groups is not None:
+        try:
+            rows, key_rows = stats_groups
+            keys = records_frame(key_rows, stats_key_columns)
+            groups = append_stats_cube(records_frame(rows), keys, stats_file, dataset_version(fetch_dir))
+            logger.info("Appended %d changed groups to %s.", groups, journal_path(stats_file))
+            stats = False
+        except Exception as e:
+            logger.info("Could not journal the changes to %s (rebuilding it from all records): %s", stats_file, e)
+    if stats:
+        try:
+            stats_stamp = dataset_version(fetch_dir)
+            stats_rows = write_stats_cube(load_records(fetch_dir), stats_file, stats_stamp)
+            logger.info("Wrote %s (%d rows).", stats_file, stats_rows)
+        except Exception as e:
+            logger.warning("Could not write statistics %s (figures will be computed from records): %s", stats_file, e)
+
+def extract(root_dir, workers=4, backup_limit=100, force_parse=False, full_scan=False, settle=None, quiet=False,
+            compact_rows=5000, stat_files=True):
+    """Scan data/, parse new or changed files and publish the extracted records.
+
+    Outputs are only written when the extracted records changed (or are
+    missing), so an unchanged data directory costs one stat per directory
+    and file and leaves them -- and the app's loaded dataset -- as they are.
+    Without stat_files, files in directories whose mtime is unchanged are not
+    stat'ed either, so files edited in place are not noticed. Changed
+    records are appended to the changelog (records.log) as long as it holds
+    at most compact_rows records; beyond that, or when records.csv was not
+    written by the last run, a new records.csv snapshot is written instead.
+    The manifest, scan cache and reports are likewise appended to, and only
+    the statistics of the changed groups are recomputed, so a small change
+    costs small writes.
+    With settle (seconds), files modified less than that long ago are left
+    for a later run. With quiet, the scan statistics of a run that changed
+    nothing are only logged at debug level.
+    Returns True if records.csv was (re)written.
+    """
+    # Setup required paths
+    data_dir = f"{root_dir}/data"
+    fetch_dir = f"{root_dir}/extracted"
+    backup_dir = f"{root_dir}/backup"
+    csv_file, parquet_dir = records_paths(fetch_dir)
+    unprocessed_file = f"{fetch_dir}/unprocessed.txt"
+    dataless_file = f"{fetch_dir}/dataless.txt"
+    image_index_file = image_index_path(fetch_dir)
+    manifest_file = f"{fetch_dir}/manifest.json"
+    scan_cache_file = f"{fetch_dir}/scan_cache.json"
+
+    manifest_state = None if force_parse else load_json_state(manifest_file, MANIFEST_VERSION, "Parse manifest", "files")
+    previous_manifest = manifest_state["files"] if manifest_state else {}
+    scan_state = None if force_parse else load_json_state(scan_cache_file, SCAN_CACHE_VERSION, "Scan cache", "dirs")
+    # A full scan lists every directory again, but still only journals the
+    # directories that changed
+    previous_scan_cache = scan_state["dirs"] if scan_state and not full_scan else {}
+    stats_version = dataset_version(fetch_dir)
+    stats_current = stats_version is not None and read_stamp(stats_path(fetch_dir)) == stats_version
+    new_scan_cache = {}
+    manifest = {}
+    settling_dirs = set()
+    parsed_count = 0
+    parsed_bytes = 0
+    reused_count = 0
+    untracked_count = 0
+    extracted_count = 0
+    dataless_count = 0
+    settle_before = time.time_ns() - int(settle * 1e9) if settle else None
+
+    # Parsing is I/O bound (mostly waiting on the network share), so files are
+    # stat'ed and parsed on a thread pool while this loop consumes the results
+    # in file order. The directory walk is a generator feeding the pool
+    # directly, so parsing starts with the first file found instead of after a
+    # full listing.
+    logger.log(logging.DEBUG if quiet else logging.INFO, "Parsing with %d worker(s).", workers)
+    start_time = time.monotonic()
+    files = scan_data_dir(data_dir, previous_scan_cache, new_scan_cache)
+    if stat_files:
+        files = ((path, valid, False) for path, valid, _ in files)
+    for path, entry, parsed in ordered_map(lambda item: process_file(item, previous_manifest, settle_before), files, workers):
+        if entry["status"] == "settling":
+            # Still being written: keep what the last run saw and list its
+            # directory again next time
+            settling_dirs.add(os.path.dirname(path))
+            if path in previous_manifest:
+                manifest[path] = previous_manifest[path]
+            continue
+        manifest[path] = entry
+        if parsed:
+            parsed_count += 1
+            parsed_bytes += entry["size"] or 0
+        elif entry["status"] != "unprocessed":
+            reused_count += 1
+
+        if entry["status"] == "record":
             extracted_count += 1
-        else:
-            dataless_fh.write(f"{path}\n")
+        elif entry["status"] == "dataless":
             dataless_count += 1
-
-logger.info(
-    "Extraction complete: %d records written to records.csv, %d files had no target data (see dataless.txt).",
-    extracted_count, dataless_count
-)
-if extracted_count == 0:
-    logger.warning(
-        "No records were extracted. The app will start but show no data. "
-        "Check that file contents/format match the expected parser (see dataless.txt/unprocessed.txt)."
+        else:
+            untracked_count += 1
+
+    elapsed = max(time.monotonic() - start_time, 1e-9)
+    # The outputs are derived from the manifest; if it is unchanged (same
+    # files, same results), so are they.
+    records_changed = manifest_state is None or manifest != previous_manifest or not os.path.exists(csv_file)
+    level = logging.DEBUG if quiet and not records_changed and not settling_dirs else logging.INFO
+    logger.log(
+        level, "Parsed %d files (%.1f MB) in %.1fs with %d worker(s): %.1f files/s, %.2f MB/s.",
+        parsed_count, parsed_bytes / 1e6, elapsed, workers, parsed_count / elapsed, parsed_bytes / 1e6 / elapsed
+    )
+    logger.log(
+        level, "Found %d .xls files: %d match the naming scheme, %d untracked (see unprocessed.txt).",
+        len(manifest), len(manifest) - untracked_count, untracked_count
     )
+    unchanged_dirs = sum(
+        1 for d, cached in new_scan_cache.items()
+        if previous_scan_cache.get(d, {}).get("mtime") == cached["mtime"]
+    )
+    logger.log(
+        level, "Scanned %d directories: %d listed, %d unchanged since the last scan.",
+        len(new_scan_cache), len(new_scan_cache) - unchanged_dirs, unchanged_dirs
+    )
+    logger.log(
+        level, "Parse manifest: %d files parsed, %d reused unchanged, %d dropped (no longer present).",
+        parsed_count, reused_count, len(set(previous_manifest) - set(manifest))
+    )
+    if settling_dirs:
+        logger.info("Skipped files still being written in %d directories; they are picked up later.", len(settling_dirs))
+        for d in settling_dirs:
+            new_scan_cache.pop(d, None)
+
+    stats_groups = None
+    if records_changed:
+        # Small changes go to the changelog, provided records.csv is still the
+        # snapshot the last run left (and the log belongs to it)
+        snapshot_version = records_version(csv_file)
+        changes = record_changes(previous_manifest, manifest) if manifest_state is not None else None
+        compact = not (
+            changes is not None and snapshot_version is not None and manifest_state.get("records") == snapshot_version
+            and len(read_changelog(fetch_dir)) + len(changes) <= compact_rows
+        )
+        # The statistics of the changed groups go to the cube's journal
+        # (stats.log) as well; with a new snapshot the cube is rebuilt too
+        if not compact and stats_current:
+            stats_file = stats_path(fetch_dir)
+            stats_groups = changed_stats_groups(previous_manifest, manifest, changes)
+            if len(read_journal(journal_path(stats_file), file_version(stats_file))) + len(stats_groups[1]) > compact_rows:
+                stats_groups = None
+
+        if not compact:
+            if changes:
+                append_changelog(fetch_dir, changes)
+                logger.info("Appended %d changed records to the changelog.", len(changes))
+        else:
+            # Back up the PREVIOUS run's records before records.csv is replaced.
+            #
+            # Only records.csv is irreplaceable; figures.html and the html/ tree are
+            # regenerable from it, so we don't copy them. The two tiny .txt reports are
+            # bundled along. Backups are compressed, content-addressed blobs listed in
+            # backup/index.json (see backup.py), and no snapshot is made when records.csv
+            # is unchanged since the last backup, so plain restarts don't pile up
+            # duplicate backups.
+            try:
+                backup_records(backup_dir, fetch_dir)
+                prune_backups(backup_dir, backup_limit)
+            except Exception as e:
+                logger.warning("Could not back up records to %s: %s", backup_dir, e)
+            publish_records(manifest, csv_file)
+            reset_changelog(fetch_dir)
+            snapshot_version = records_version(csv_file)
+            logger.info("Wrote a new records.csv snapshot.")
+        # With a new snapshot, the reports and the manifest are rewritten in
+        # file order too; otherwise only their changes are appended
+        publish_reports(
+            manifest, previous_manifest, {"dataless": dataless_file, "unprocessed": unprocessed_file},
+            rewrite=compact or manifest_state is None
+        )
+        save_json_state(
+            manifest_file, MANIFEST_VERSION, "parse manifest", "files", manifest_state, manifest, compact_rows,
+            rewrite=compact, records=snapshot_version
+        )
+    save_json_state(scan_cache_file, SCAN_CACHE_VERSION, "scan cache", "dirs", scan_state, new_scan_cache, compact_rows)
+
+    # Image index: the .jpg files next to every extracted data file, collected
+    # during the scan above, so the app does not have to list those directories
+    # on the share for every Submit. It only changes when a directory holding
+    # a record does.
+    new_image_index = image_index(manifest, new_scan_cache)
+    if manifest_state is not None and scan_state is not None and not full_scan:
+        previous_image_index = image_index(previous_manifest, previous_scan_cache)
+    else:
+        previous_image_index = load_image_index(fetch_dir)
+    # Changed directories are appended to its journal (images.log) until that
+    # outgrows compact_rows
+    image_changes = state_changes(previous_image_index, new_image_index)
+    if image_changes or not os.path.exists(image_index_file):
+        try:
+            image_journal = read_journal(journal_path(image_index_file), file_version(image_index_file))
+            if os.path.exists(image_index_file) and len(image_journal) + len(image_changes) <= compact_rows:
+                append_image_index(image_index_file, image_changes)
+            else:
+                write_image_index(image_index_file, new_image_index)
+        except Exception as e:
+            logger.warning("Could not write image index %s (the app will list image directories itself): %s", image_index_file, e)
+
+    if not records_changed:
+        logger.log(level, "Extracted records unchanged: %d records.", extracted_count)
+    else:
+        logger.info(
+            "Extraction complete: %d records, %d files had no target data (see dataless.txt).",
+            extracted_count, dataless_count
+        )
+    if extracted_count == 0 and level == logging.INFO:
+        logger.warning(
+            "No records were extracted. The app will start but show no data. "
+            "Check that file contents/format match the expected parser (see dataless.txt/unprocessed.txt)."
+        )
+
+    write_derived(
+        fetch_dir,
+        parquet=read_stamp(parquet_dir) != records_version(csv_file),
+        stats=read_stamp(stats_path(fetch_dir)) != dataset_version(fetch_dir),
+        stats_groups=stats_groups
+    )
+    return records_changed
 
-# Generate an Excel copy of records.csv. This is a convenience duplicate only
-# (the app and HTML stages read records.csv, never the xlsx), so it must never
-# break the run -- any problem just logs and continues.
-#
-#   * If the dataset is larger than the configured limit, skip Excel entirely:
-#     building it would be slow and Excel itself caps at ~1.05M rows anyway.
-#   * Otherwise build it by streaming row-by-row with openpyxl's write_only mode
-#     so we never hold the whole workbook in memory (the old df.to_excel path
-#     materialised every cell as an object -> multi-GB spikes / OOM).
-if excel_max_rows <= 0:
-    logger.info("Skipping records.xlsx (Excel generation disabled). Use records.csv.")
-elif extracted_count > excel_max_rows:
+def watch(root_dir, interval, settle, full_scan_every=30, **options):
+    """Extract new and changed files every interval seconds until interrupted.
+
+    Passes only look into directories whose mtime changed; every
+    full_scan_every-th pass lists and stats everything, so files edited in
+    place are picked up too.
+    """
     logger.info(
-        "Skipping records.xlsx: %d rows exceeds the limit of %d. Use records.csv for the full data.",
-        extracted_count, excel_max_rows
+        "Watching %s/data every %ss (files settle for %ss, full scan every %d passes).",
+        root_dir, interval, settle, full_scan_every
     )
-else:
-    try:
-        from openpyxl import Workbook
-
-        wb = Workbook(write_only=True)
-        ws = wb.create_sheet()
-        with open(csv_file, newline='') as f:
-            for row in csv.reader(f):
-                ws.append(row)
-        wb.save(excel_file)
-        logger.info("Wrote %s (%d data rows).", excel_file, extracted_count)
-    except Exception as e:
-        logger.warning("Could not write Excel file %s (skipping, not required): %s", excel_file, e)
-
-logger.info("Finished data processing")
\ No newline at end of file
+    for number in itertools.count(1):
+        time.sleep(interval)
+        full_scan = full_scan_every > 0 and number % full_scan_every == 0
+        try:
+            extract(root_dir, settle=settle, quiet=True, full_scan=full_scan, stat_files=full_scan, **options)
+        except Exception:
+            logger.exception("Extraction failed; retrying in %ss.", interval)
+
+def main():
+    # Setup arguments for the python file
+    # Use: python3 process_data.py -d </path/to/dir> -b <backup_limit> [--watch]
+    parser = argparse.ArgumentParser(description="Process a directory path.")
+    parser.add_argument('-d', '--directory', type=str, default=".", help="Path to the directory (optional).")
+    parser.add_argument('-b', '--backup', type=int, default=100, help="Backup number (optional, default: 100).")
+    parser.add_argument('-e', '--excel-max-rows', type=int, default=None,
+                        help="Deprecated and ignored: records.xlsx is exported on request by the app.")
+    parser.add_argument('-f', '--force', action='store_true',
+                        help="Re-parse every file, ignoring the parse manifest from previous runs (optional).")
+    parser.add_argument('-w', '--workers', type=int, default=4,
+                        help="Number of files parsed in parallel (optional, default: 4). Use 1 to parse sequentially.")
+    parser.add_argument('--full-scan', action='store_true',
+                        help="List every directory under data/ even if its mtime is unchanged since the last scan (optional).")
+    parser.add_argument('--compact-rows', type=int, default=5000,
+                        help="Changed records kept in the changelog before records.csv is rewritten (optional, default: 5000). Use 0 to always rewrite.")
+    parser.add_argument('--watch', action='store_true',
+                        help="Keep running and extract new or changed files as they appear (optional).")
+    parser.add_argument('--interval', type=float, default=10,
+                        help="Seconds between scans in --watch mode (optional, default: 10).")
+    parser.add_argument('--settle', type=float, default=10,
+                        help="In --watch mode, files modified less than this many seconds ago are left for a later scan (optional, default: 10).")
+    parser.add_argument('--full-scan-every', type=int, default=30,
+                        help="In --watch mode, list and stat every file every this many passes to catch files edited in place (optional, default: 30). Use 0 to never.")
+    args = parser.parse_args()
+    root_dir = args.directory
+    fetch_dir = f"{root_dir}/extracted"
+    excel_file = f"{fetch_dir}/records.xlsx"
+
+    # Create required directories
+    os.makedirs(fetch_dir, exist_ok=True)
+    os.makedirs(f"{root_dir}/backup", exist_ok=True)
+    os.makedirs(f"{fetch_dir}/html", exist_ok=True)
+
+    # Configure logging (stdout, captured per-container by `docker logs`)
+    configure_logging()
+    logger.info("Starting data processing (directory=%s, backup_limit=%s)", root_dir, args.backup)
+
+    # records.xlsx is no longer written here: the app builds Excel exports on
+    # request (/export/records.xlsx). Remove a copy left by earlier versions so
+    # nobody opens stale data.
+    if args.excel_max_rows is not None:
+        logger.warning("-e/--excel-max-rows is deprecated and ignored; download Excel exports from the app.")
+    if os.path.exists(excel_file):
+        try:
+            os.remove(excel_file)
+            logger.info("Removed %s (Excel exports are now built by the app).", excel_file)
+        except Exception as e:
+            logger.warning("Could not remove stale %s: %s", excel_file, e)
+
+    options = dict(workers=max(1, args.workers), backup_limit=args.backup, compact_rows=args.compact_rows)
+    if args.watch:
+        # The first pass honours -f/--full-scan; later passes are incremental
+        extract(root_dir, force_parse=args.force, full_scan=args.full_scan, settle=args.settle, **options)
+        watch(root_dir, args.interval, args.settle, args.full_scan_every, **options)
+    else:
+        extract(root_dir, force_parse=args.force, full_scan=args.full_scan, **options)
+        logger.info("Finished data processing")
+
+if __name__ == '__main__':
+    main()
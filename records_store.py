@@ -0,0 +1,563 @@
+import os
+import json
+import shutil
+import logging
+import threading
+from io import StringIO
+import numpy as np
+import pandas as pd
+
+# Shared access to the extracted records for all entry-point scripts.
+#
+# records.csv stays the primary, human-readable output of process_data.py.
+# Next to it, process_data.py writes a typed, columnar copy partitioned by
+# microscope and test (records.parquet/microscope=<m>/test=<t>/...). Readers
+# load that copy when it is up to date: no CSV text parsing, no date
+# re-parsing, and only the columns/partitions a caller asks for are read.
+#
+# Whether the Parquet copy matches records.csv is decided by a stamp file
+# (records.parquet.stamp) holding the size and mtime records.csv had when the
+# copy was written. If records.csv is replaced by anything else (e.g. a backup
+# copied back by hand), the stamp no longer matches and readers fall back to
+# the CSV, so they never see stale data.
+#
+# The same goes for the statistics cube (stats.csv + stats.csv.stamp): mean,
+# std and count of every metric per (microscope, objective, test, bead_size,
+# bead_number, date), from which the per-date figure statistics of any filter
+# can be combined without touching the raw rows.
+#
+# records.csv is a snapshot. Small changes after it are not written by
+# rewriting it but appended to a changelog (records.log, JSON lines): a first
+# line naming the records.csv version it applies to, then one line per added
+# or changed record (its records.csv row) or removed record (row null), keyed
+# by file_path. Readers (load_records) apply the log on top of the snapshot;
+# a log written for another records.csv version is ignored. process_data.py
+# compacts the log into a new records.csv once it grows past a threshold. The
+# Parquet copy describes the snapshot only; the statistics cube covers the
+# log too and is stamped with dataset_version.
+#
+# The statistics cube (stats.log) and the image index (images.log) have
+# journals of the same kind, and so do process_data.py's own state files: a
+# first line {"base": version} naming the version (see file_version) of the
+# file the journal applies to, then one JSON object per change. All of them
+# are read with read_journal and appended to with append_journal; a journal
+# whose base does not match is ignored, and an incomplete last line (a write
+# in progress) is left out.
+
+logger = logging.getLogger(__name__)
+
+record_columns = [
+    "date", "microscope", "objective", "test", "bead_size", "bead_number",
+    "far_red", "red", "uv", "dual", "x", "y", "z", "file_path"
+]
+partition_columns = ["microscope", "test"]
+metric_columns = ["far_red", "red", "uv", "dual", "x", "y", "z"]
+stats_key_columns = ["microscope", "objective", "test", "bead_size", "bead_number", "date"]
+
+# Name columns are always read as text (a microscope called "1" is still a
+# name), so the CSV and Parquet paths give the same types.
+_csv_dtypes = {"microscope": str, "objective": str, "test": str}
+
+
+def records_paths(fetch_dir):
+    """Paths of records.csv and its Parquet copy in the extracted directory"""
+    return f"{fetch_dir}/records.csv", f"{fetch_dir}/records.parquet"
+
+
+def stats_path(fetch_dir):
+    """Path of the per-date statistics cube in the extracted directory"""
+    return f"{fetch_dir}/stats.csv"
+
+
+def image_index_path(fetch_dir):
+    """Path of the image index (.jpg files per data directory) in the extracted directory"""
+    return f"{fetch_dir}/images.json"
+
+
+def changelog_path(fetch_dir):
+    """Path of the records changelog in the extracted directory"""
+    return f"{fetch_dir}/records.log"
+
+
+def file_version(path):
+    """Version stamp of a file (size and mtime), or None if it does not exist"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return f"{st.st_size}-{st.st_mtime_ns}"
+
+
+def records_version(csv_file):
+    """Version stamp of records.csv (size and mtime), or None if it does not exist"""
+    return file_version(csv_file)
+
+
+def journal_path(path):
+    """Path of the journal of a snapshot file (stats.csv -> stats.log)"""
+    return f"{os.path.splitext(path)[0]}.log"
+
+
+def journal_base(log_file):
+    """Version named in the first line of a journal, or None"""
+    try:
+        with open(log_file) as fh:
+            header = fh.readline()
+        return json.loads(header)["base"] if header.endswith("\n") else None
+    except Exception:
+        return None
+
+
+def read_journal(log_file, base):
+    """Entries of a journal, in order, if it applies to version base; [] otherwise"""
+    entries = []
+    try:
+        with open(log_file) as fh:
+            header = fh.readline()
+            if base is None or not header.endswith("\n") or json.loads(header)["base"] != base:
+                return entries
+            for line in fh:
+                if not line.endswith("\n"):
+                    break  # a write in progress
+                entries.append(json.loads(line))
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+def append_journal(log_file, base, entries):
+    """Append entries to the journal of version base; a journal of another version is started afresh.
+
+    Lines are written in one append, so readers see all of them or an
+    incomplete last line they skip.
+    """
+    lines = "".join(json.dumps(entry) + "\n" for entry in entries)
+    if journal_base(log_file) != base:
+        tmp_file = f"{log_file}.tmp"
+        with open(tmp_file, "w") as fh:
+            fh.write(json.dumps({"base": base}) + "\n" + lines)
+        os.replace(tmp_file, log_file)
+        return
+    with open(log_file, "a") as fh:
+        fh.write(lines)
+
+
+def remove_journal(log_file):
+    """Remove a journal (after its changes were written into a new snapshot)"""
+    try:
+        os.remove(log_file)
+    except FileNotFoundError:
+        pass
+
+
+def apply_journal(mapping, entries):
+    """Apply {"key", "value"} journal entries to mapping in place (value None removes the key)"""
+    for entry in entries:
+        if entry["value"] is None:
+            mapping.pop(entry["key"], None)
+        else:
+            mapping[entry["key"]] = entry["value"]
+    return mapping
+
+
+def dataset_version(fetch_dir):
+    """Version of the records as readers see them: records.csv plus its changelog, or None"""
+    csv_file, _ = records_paths(fetch_dir)
+    version = records_version(csv_file)
+    if version is None:
+        return None
+    log_file = changelog_path(fetch_dir)
+    try:
+        log_size = os.path.getsize(log_file)
+    except OSError:
+        return version
+    if log_size == 0 or journal_base(log_file) != version:
+        return version
+    return f"{version}+{log_size}"
+
+
+def read_changelog(fetch_dir):
+    """Changes in the changelog that apply to the current records.csv: {file_path: row or None}, in log order"""
+    csv_file, _ = records_paths(fetch_dir)
+    changes = {}
+    for entry in read_journal(changelog_path(fetch_dir), records_version(csv_file)):
+        changes.pop(entry["file_path"], None)
+        changes[entry["file_path"]] = entry["row"]
+    return changes
+
+
+def append_changelog(fetch_dir, changes):
+    """Append (file_path, row or None) changes to the changelog of the current records.csv"""
+    csv_file, _ = records_paths(fetch_dir)
+    entries = [{"file_path": path, "row": row} for path, row in changes]
+    append_journal(changelog_path(fetch_dir), records_version(csv_file), entries)
+
+
+def rebase_changelog(fetch_dir):
+    """Apply the changelog to the current records.csv (after both were restored from the same backup)"""
+    csv_file, _ = records_paths(fetch_dir)
+    log_file = changelog_path(fetch_dir)
+    tmp_file = f"{log_file}.tmp"
+    with open(log_file) as src, open(tmp_file, "w") as dst:
+        src.readline()
+        dst.write(json.dumps({"base": records_version(csv_file)}) + "\n")
+        shutil.copyfileobj(src, dst, 1 << 20)
+    os.replace(tmp_file, log_file)
+
+
+def reset_changelog(fetch_dir):
+    """Remove the changelog (after its changes were compacted into records.csv)"""
+    remove_journal(changelog_path(fetch_dir))
+
+
+def records_frame(rows, columns=None):
+    """Records from records.csv rows (lists of strings), typed exactly like records.csv read by read_records_csv"""
+    text = pd.DataFrame(rows, columns=record_columns).to_csv(index=False)
+    return read_records_csv(StringIO(text), columns)
+
+
+def _changelog_records(changes, columns):
+    return records_frame([row for row in changes.values() if row is not None], columns)
+
+
+def read_stamp(path):
+    """Stamp written next to a derived file or directory by write_stamp, or None"""
+    try:
+        with open(f"{path}.stamp") as fh:
+            return fh.read().strip()
+    except OSError:
+        return None
+
+
+def write_stamp(path, stamp):
+    """Record which records.csv version the derived file or directory was built from"""
+    tmp_file = f"{path}.stamp.tmp"
+    with open(tmp_file, "w") as fh:
+        fh.write(stamp)
+    os.replace(tmp_file, f"{path}.stamp")
+
+
+def _partitioning():
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    return ds.partitioning(
+        pa.schema([(col, pa.string()) for col in partition_columns]), flavor="hive"
+    )
+
+
+def read_records_csv(csv_file, columns=None):
+    """Read records.csv (or a subset of its columns) with parsed dates"""
+    df = pd.read_csv(csv_file, usecols=columns, dtype=_csv_dtypes)
+    if 'date' in df.columns:
+        df = df.assign(date=lambda x: pd.to_datetime(x['date'], format='%Y%m%d', errors='coerce'))
+    return df
+
+
+def write_records_parquet(df, dataset_dir, stamp):
+    """Write the typed, partitioned Parquet copy of the records read from records.csv.
+
+    stamp is the records_version of that records.csv. The dataset is built in
+    a temporary directory and swapped in, and the stamp is written last, so
+    readers see either the old or the new copy, never a partial one.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    if df.empty:
+        # Nothing to partition; readers fall back to the (header-only) CSV.
+        shutil.rmtree(dataset_dir, ignore_errors=True)
+        if os.path.exists(f"{dataset_dir}.stamp"):
+            os.remove(f"{dataset_dir}.stamp")
+        return
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    tmp_dir = f"{dataset_dir}.tmp"
+    old_dir = f"{dataset_dir}.old"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    ds.write_dataset(
+        table, tmp_dir, format="parquet", partitioning=_partitioning(),
+        existing_data_behavior="overwrite_or_ignore"
+    )
+
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(dataset_dir):
+        os.rename(dataset_dir, old_dir)
+    os.rename(tmp_dir, dataset_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    write_stamp(dataset_dir, stamp)
+
+
+def build_stats_cube(df):
+    """Mean, std and count of every metric per (microscope, objective, test, bead_size, bead_number, date).
+
+    Columns: the key columns, then <metric>_mean, <metric>_std and
+    <metric>_count for each metric. Rows without a valid date are left out,
+    as they never show up in a figure.
+    """
+    grouped = df[df['date'].notna()].groupby(stats_key_columns, dropna=False)[metric_columns]
+    cube = grouped.agg(['mean', 'std', 'count'])
+    cube.columns = [f"{col}_{stat}" for col, stat in cube.columns]
+    return cube.reset_index()
+
+
+def write_stats_cube(df, stats_file, stamp):
+    """Build the statistics cube from the records and write it (via temp file + rename) with its stamp"""
+    cube = build_stats_cube(df)
+    tmp_file = f"{stats_file}.tmp"
+    cube.to_csv(tmp_file, index=False, date_format='%Y%m%d')
+    os.replace(tmp_file, stats_file)
+    remove_journal(journal_path(stats_file))
+    write_stamp(stats_file, stamp)
+    return len(cube)
+
+
+def _json_value(value):
+    # NaN/NaT become null, numpy scalars plain Python values
+    if pd.isna(value):
+        return None
+    return value.item() if hasattr(value, "item") else value
+
+
+def append_stats_cube(df, keys, stats_file, stamp):
+    """Append the new statistics of some groups to the cube's journal (stats.log) and stamp the cube.
+
+    keys: the stats_key_columns of every group that changed; df: all records
+    of those groups. Each group gets one journal line with its key and its
+    new row (null once it has no records left). Bead size and number must be
+    numbers (they are written as such). Returns the number of groups written.
+    """
+    for col in ("bead_size", "bead_number"):
+        for frame in (df, keys):
+            if not pd.api.types.is_numeric_dtype(frame[col].dtype) and not frame[col].isna().all():
+                raise ValueError(f"{col} holds values that are not numbers")
+    keys = keys.loc[keys['date'].notna(), stats_key_columns].drop_duplicates()
+    groups = keys.merge(build_stats_cube(df), on=stats_key_columns, how="left", indicator=True)
+    entries = []
+    for group in groups.to_dict("records"):
+        found = group.pop("_merge") == "both"
+        key = [_json_value(group.pop(col)) for col in stats_key_columns]
+        key[3:5] = [None if value is None else float(value) for value in key[3:5]]
+        key[5] = key[5].strftime('%Y%m%d')
+        row = {col: _json_value(value) for col, value in group.items()} if found else None
+        entries.append({"key": key, "row": row})
+    if entries:
+        append_journal(journal_path(stats_file), file_version(stats_file), entries)
+    write_stamp(stats_file, stamp)
+    return len(entries)
+
+
+def _apply_stats_journal(cube, entries):
+    # The last entry of every group replaces the group's row in the cube
+    changes = {}
+    for entry in entries:
+        changes[tuple(entry["key"])] = entry["row"]
+    keys = pd.DataFrame([list(key) for key in changes], columns=stats_key_columns)
+    rows = pd.DataFrame(
+        [list(key) + [row[col] for col in cube.columns[len(stats_key_columns):]]
+         for key, row in changes.items() if row is not None],
+        columns=cube.columns
+    )
+    for frame in (keys, rows):
+        frame['date'] = pd.to_datetime(frame['date'], format='%Y%m%d')
+        for col in ("microscope", "objective", "test"):
+            frame[col] = frame[col].astype(object).where(frame[col].notna(), np.nan)
+        for col in ("bead_size", "bead_number"):
+            values = frame[col].astype(float)
+            if pd.api.types.is_integer_dtype(cube[col].dtype) and not (values.isna() | (values % 1 == 0)).all():
+                cube[col] = cube[col].astype(float)
+            elif not pd.api.types.is_numeric_dtype(cube[col].dtype):
+                raise ValueError(f"{col} in the statistics cube is not numeric")
+            if pd.api.types.is_integer_dtype(cube[col].dtype) and not values.isna().any():
+                values = values.astype(cube[col].dtype)
+            frame[col] = values
+    for col in cube.columns[len(stats_key_columns):]:
+        rows[col] = rows[col].astype(cube[col].dtype if col.endswith("_count") else float)
+    kept = cube.merge(keys, on=stats_key_columns, how="left", indicator=True)
+    kept = kept[kept["_merge"] == "left_only"].drop(columns="_merge")
+    parts = [frame for frame in (kept, rows) if not frame.empty]
+    if not parts:
+        return cube.iloc[:0]
+    return pd.concat(parts, ignore_index=True).sort_values(stats_key_columns, kind="stable", ignore_index=True)
+
+
+def load_stats(fetch_dir):
+    """Load the statistics cube (with its journal applied), or None if it is missing or does not match the
+    records (and their changelog)"""
+    stats_file = stats_path(fetch_dir)
+    version = dataset_version(fetch_dir)
+    if version is None or read_stamp(stats_file) != version:
+        return None
+    try:
+        # The journal's values are exact, so the snapshot is read exactly too
+        cube = pd.read_csv(stats_file, dtype=_csv_dtypes, float_precision="round_trip")
+        cube['date'] = pd.to_datetime(cube['date'], format='%Y%m%d', errors='coerce')
+        entries = read_journal(journal_path(stats_file), file_version(stats_file))
+        return _apply_stats_journal(cube, entries) if entries else cube
+    except Exception:
+        logger.exception("Could not read %s; statistics will be computed from the records.", stats_file)
+        return None
+
+
+def _filter_expression(filters):
+    import pyarrow.dataset as ds
+
+    expression = None
+    for col, value in (filters or {}).items():
+        if value is None:
+            continue
+        condition = ds.field(col) == value
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def load_records(fetch_dir, columns=None, filters=None):
+    """Load the extracted records with parsed dates.
+
+    columns: optional list of columns to read (default: all).
+    filters: optional {column: value} equality filters; None values are ignored.
+
+    Reads the Parquet copy (with column projection and partition/row-group
+    filter pushdown) when it matches records.csv, otherwise records.csv, and
+    applies the changelog on top.
+    Raises FileNotFoundError if there are no records at all.
+    """
+    csv_file, dataset_dir = records_paths(fetch_dir)
+    columns = list(columns) if columns is not None else list(record_columns)
+    version = records_version(csv_file)
+    changes = read_changelog(fetch_dir)
+    # file_path is the changelog key, so it is read whenever there are changes
+    read_columns = columns if not changes or "file_path" in columns else columns + ["file_path"]
+
+    df = None
+    if version is not None and read_stamp(dataset_dir) == version:
+        try:
+            import pyarrow.dataset as ds
+
+            dataset = ds.dataset(dataset_dir, format="parquet", partitioning=_partitioning())
+            table = dataset.to_table(columns=read_columns, filter=_filter_expression(filters))
+            df = table.to_pandas(ignore_metadata=True)
+        except ImportError:
+            logger.info("pyarrow is not installed; reading records from %s.", csv_file)
+        except Exception:
+            logger.exception("Could not read %s; falling back to %s.", dataset_dir, csv_file)
+
+    if df is None:
+        df = read_records_csv(csv_file, read_columns)
+        for col, value in (filters or {}).items():
+            if value is not None:
+                df = df[df[col] == value]
+        df = df[read_columns]
+
+    if changes:
+        added = _changelog_records(changes, read_columns)
+        for col, value in (filters or {}).items():
+            if value is not None:
+                added = added[added[col] == value]
+        kept = df[~df["file_path"].isin(changes.keys())]
+        if not added.empty:
+            df = pd.concat([kept, added], ignore_index=True) if not kept.empty else added.reset_index(drop=True)
+        else:
+            df = kept.reset_index(drop=True)
+    return df[columns]
+
+
+def write_records_excel(df, excel_file):
+    """Write records (as in records.csv, dates as YYYYMMDD, missing values as NA) to an Excel file via temp file + rename.
+
+    The workbook is streamed row by row with openpyxl's write-only mode, so
+    it is never held in memory as cell objects.
+    """
+    from openpyxl import Workbook
+
+    df = df.assign(date=df['date'].dt.strftime('%Y%m%d')) if 'date' in df.columns else df
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(list(df.columns))
+    for row in df.astype(object).where(df.notna(), "NA").itertuples(index=False, name=None):
+        ws.append(row)
+    tmp_file = f"{excel_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    wb.save(tmp_file)
+    os.replace(tmp_file, excel_file)
+
+
+def stream_records_csv(chunks, columns):
+    """Yield records.csv-formatted text (header first, dates as YYYYMMDD, missing values as NA) for an iterable of record dataframes"""
+    yield pd.DataFrame(columns=columns).to_csv(index=False)
+    for chunk in chunks:
+        yield chunk.to_csv(index=False, header=False, date_format='%Y%m%d', na_rep='NA')
+
+
+class _ChunkSink:
+    """Write-only file object collecting what a writer produces, to be yielded piecewise"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def stream_records_parquet(chunks, schema):
+    """Yield a Parquet file, one row group per record dataframe of chunks, as bytes.
+
+    Only the current row group is held in memory; the file footer follows
+    after the last chunk.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema)
+    for chunk in chunks:
+        writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+def write_image_index(index_file, dirs):
+    """Write the image index: {directory: {"mtime": ..., "images": [file names]}}"""
+    tmp_file = f"{index_file}.tmp"
+    with open(tmp_file, "w") as fh:
+        json.dump({"dirs": dirs}, fh)
+    os.replace(tmp_file, index_file)
+    remove_journal(journal_path(index_file))
+
+
+def append_image_index(index_file, changes):
+    """Append {directory: entry or None} changes to the image index's journal (images.log)"""
+    entries = [{"key": directory, "value": entry} for directory, entry in changes.items()]
+    append_journal(journal_path(index_file), file_version(index_file), entries)
+
+
+def load_image_index(fetch_dir):
+    """Load the image index written by process_data.py, or {} if it is missing or unreadable"""
+    index_file = image_index_path(fetch_dir)
+    try:
+        with open(index_file) as fh:
+            dirs = json.load(fh)["dirs"]
+        return apply_journal(dirs, read_journal(journal_path(index_file), file_version(index_file)))
+    except FileNotFoundError:
+        return {}
+    except Exception:
+        logger.exception("Could not read %s; image directories will be listed on request.", index_file)
+        return {}